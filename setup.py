@@ -115,6 +115,10 @@ setup(
     tests_require=tests_require,
     extras_require={
         'test': tests_require,
+        'brotli': ['brotli'],
+        'zstd': ['zstandard'],
+        'httpx': ['httpx[http2]'],
+        'orjson': ['orjson'],
     },
     entry_points={
         'udata.harvesters': [
@@ -124,6 +128,15 @@ setup(
         'udata.models': [
             'ckan = udata_ckan.models',
         ],
+        'udata.tasks': [
+            'ckan = udata_ckan.tasks',
+        ],
+        'udata.apis': [
+            'ckan = udata_ckan.api',
+        ],
+        'udata.commands': [
+            'ckan = udata_ckan.commands',
+        ],
     },
     license='AGPL',
     zip_safe=False,
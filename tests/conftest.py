@@ -13,6 +13,9 @@ def pytest_configure(config):
     config.addinivalue_line(
         "markers", "ckan_data(fixture): specify the data fixture they rely on. This allows `data`, `result` and `kwargs` fixtures to be populated with the associated data harvest data."
     )
+    config.addinivalue_line(
+        "markers", "frontend: load the udata API and frontend"
+    )
 
 class CkanError(ValueError):
     pass
@@ -63,3 +66,40 @@ def ckan():
 class UdataCkanProvider(BaseProvider):
     def unique_url(self):
         return '{0}?_={1}'.format(faker.uri(), faker.unique_string())
+
+    def ckan_package(self, **kwargs):
+        '''A valid CKAN package with a single resource, overridden by `kwargs`'''
+        return {**{
+            'id': faker.uuid4(),
+            'name': faker.unique_string(),
+            'title': faker.sentence(),
+            'notes': None,
+            'maintainer': None,
+            'maintainer_email': None,
+            'author': None,
+            'author_email': None,
+            'license_id': None,
+            'license_title': None,
+            'metadata_created': faker.iso8601(),
+            'metadata_modified': faker.iso8601(),
+            'organization': None,
+            'private': False,
+            'state': 'active',
+            'type': 'dataset',
+            'tags': [],
+            'extras': [],
+            'resources': [{
+                'id': faker.uuid4(),
+                'position': 0,
+                'name': faker.word(),
+                'description': None,
+                'url': faker.unique_url(),
+                'format': 'csv',
+                'mimetype': None,
+                'size': None,
+                'hash': None,
+                'created': faker.iso8601(),
+                'last_modified': None,
+                'resource_type': 'file',
+            }],
+        }, **kwargs}
@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from flask import url_for
+
+from udata.harvest.models import HarvestJob
+from udata.harvest.tests.factories import HarvestSourceFactory
+
+from udata_ckan import api as ckan_api
+from udata_ckan.harvesters import LATENCY_BUCKETS
+
+
+pytestmark = [
+    pytest.mark.usefixtures('clean_db'),
+    pytest.mark.options(PLUGINS=['ckan']),
+    pytest.mark.frontend,
+]
+
+
+def test_source_metrics(api):
+    source = HarvestSourceFactory(backend='ckan')
+    now = datetime.utcnow()
+    data = {
+        'transfer': {'package_list': {'requests': 1, 'errors': 0, 'wire': 10, 'decoded': 20}},
+        'latency': {'package_list': [1, 0, 0, 0, 0, 0, 0, 0]},
+        'throughput': {'items': 0, 'duration': 1.0, 'items_per_second': 0.0},
+    }
+    HarvestJob.objects.create(source=source, status='done', data=data,
+                              created=now - timedelta(hours=1))
+    HarvestJob.objects.create(source=source, status='failed', created=now)
+
+    response = api.get(url_for('api.ckan_source_metrics', ident=source.slug, limit=1))
+
+    assert response.status_code == 200
+    assert len(response.json) == 1
+    metrics = response.json[0]
+    assert metrics['status'] == 'failed'
+    assert metrics['transfer'] is None
+    assert metrics['latency_buckets'] == list(LATENCY_BUCKETS)
+
+    response = api.get(url_for('api.ckan_source_metrics', ident=source.slug))
+
+    assert len(response.json) == 2
+    metrics = response.json[1]
+    assert metrics['transfer']['package_list']['wire'] == 10
+    assert metrics['latency']['package_list'][0] == 1
+    assert metrics['throughput']['duration'] == 1.0
+
+
+def test_source_metrics_limit_is_clamped(api, monkeypatch):
+    monkeypatch.setattr(ckan_api, 'MAX_LIMIT', 2)
+    source = HarvestSourceFactory(backend='ckan')
+    now = datetime.utcnow()
+    for hours in range(3):
+        HarvestJob.objects.create(source=source, status='done',
+                                  created=now - timedelta(hours=hours))
+
+    response = api.get(url_for('api.ckan_source_metrics', ident=source.slug, limit=1000))
+    assert len(response.json) == 2
+
+    response = api.get(url_for('api.ckan_source_metrics', ident=source.slug, limit=0))
+    assert len(response.json) == 1
@@ -1,8 +1,11 @@
 from datetime import date
+import gzip
 import json
 import pytest
 import random
+import requests
 
+from cachelib import SimpleCache
 from udata.app import create_app
 from udata.core.organization.factories import OrganizationFactory
 from udata.harvest import actions
@@ -13,7 +16,9 @@ from udata.core.spatial.factories import GeoZoneFactory
 from udata.tests.plugin import drop_db
 from udata.utils import faker
 
-from udata_ckan.harvesters import ALLOWED_RESOURCE_TYPES
+from udata_ckan import harvesters
+from udata_ckan.harvesters import ALLOWED_RESOURCE_TYPES, CkanBackend
+from udata_ckan.schemas import normalize_tag
 from udata_ckan.schemas.ckan import RESOURCE_TYPES
 
 class CkanSettings(Testing):
@@ -627,6 +632,798 @@ def test_max_items(app, rmock):
     assert len(source.get_last_job().items) == 1
     assert source.get_last_job().items[0].remote_id == id_a
 
+
+def test_package_list_pagination(app, rmock, monkeypatch):
+    '''CKAN Harvester should page through package_list'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    monkeypatch.setattr(CkanBackend, 'page_size', 2)
+    names = [faker.unique_string() for _ in range(3)]
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, [
+        {'json': {'success': True, 'result': names[:2]}, 'status_code': 200,
+         'headers': {'Content-Type': 'application/json'}},
+        {'json': {'success': True, 'result': names[2:]}, 'status_code': 200,
+         'headers': {'Content-Type': 'application/json'}},
+        {'json': {'success': True, 'result': []}, 'status_code': 200,
+         'headers': {'Content-Type': 'application/json'}},
+    ])
+    for name in names:
+        rmock.get(f"{PACKAGE_SHOW_URL}?id={name}",
+                  json={'success': True, 'result': minimal_data(name=name)},
+                  status_code=200, headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    list_requests = [r for r in rmock.request_history if r.path.endswith('package_list')]
+    # Only an empty page ends the listing
+    assert [r.qs.get('offset') for r in list_requests] == [None, ['2'], ['3']]
+    assert len(source.get_last_job().items) == 3
+
+
+def test_package_list_pagination_ignored(app, rmock, monkeypatch):
+    '''CKAN Harvester should list once from a package_list ignoring pagination'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    monkeypatch.setattr(CkanBackend, 'page_size', 2)
+    names = [faker.unique_string() for _ in range(3)]
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': names}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    for name in names:
+        rmock.get(f"{PACKAGE_SHOW_URL}?id={name}",
+                  json={'success': True, 'result': minimal_data(name=name)},
+                  status_code=200, headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    list_requests = [r for r in rmock.request_history if r.path.endswith('package_list')]
+    assert len(list_requests) == 1
+    assert len(source.get_last_job().items) == 3
+
+
+def test_package_search_capped_rows(app, rmock):
+    '''CKAN Harvester should page through package_search pages shorter than requested'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_SEARCH_URL = '{}package_search'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    names = [faker.unique_string() for _ in range(3)]
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'filters': [{'key': 'organization', 'value': 'org'}],
+    })
+    # The server caps `rows` to 2 (`ckan.search.rows_max`)
+    rmock.get(PACKAGE_SEARCH_URL, [
+        {'json': {'success': True, 'result': {'count': 3, 'results': [
+            {'name': name} for name in page
+        ]}}, 'status_code': 200, 'headers': {'Content-Type': 'application/json'}}
+        for page in (names[:2], names[2:])
+    ])
+    for name in names:
+        rmock.get(f"{PACKAGE_SHOW_URL}?id={name}",
+                  json={'success': True, 'result': minimal_data(name=name)},
+                  status_code=200, headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    search_requests = [r for r in rmock.request_history if r.path.endswith('package_search')]
+    assert [r.qs.get('start') for r in search_requests] == [None, ['2']]
+    assert len(source.get_last_job().items) == 3
+
+
+@pytest.mark.options(HARVEST_MAX_ITEMS=1)
+def test_max_items_stops_listing(app, rmock, monkeypatch):
+    '''CKAN Harvester should not fetch more listing pages once max items is reached'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    monkeypatch.setattr(CkanBackend, 'page_size', 1)
+    name = faker.unique_string()
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': [name]}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_SHOW_URL, json={'success': True, 'result': minimal_data(name=name)},
+              status_code=200, headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    list_requests = [r for r in rmock.request_history if r.path.endswith('package_list')]
+    assert len(list_requests) == 1
+    assert len(source.get_last_job().items) == 1
+
+
+@pytest.mark.options(HARVEST_PREVIEW_MAX_ITEMS=2)
+def test_preview_uses_a_single_package_search(app, rmock):
+    '''CKAN Harvester preview should only rely on a single package_search request'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_SEARCH_URL = '{}package_search'.format(API_URL)
+
+    packages = [
+        minimal_data(resources=[{
+            'id': faker.uuid4(),
+            'position': 0,
+            'name': faker.word(),
+            'description': None,
+            'url': faker.unique_url(),
+            'format': 'csv',
+            'mimetype': None,
+            'size': None,
+            'hash': None,
+            'created': faker.iso8601(),
+            'last_modified': None,
+            'resource_type': 'file',
+        }])
+        for _ in range(2)
+    ]
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_SEARCH_URL, json={'success': True, 'result': {'results': packages}},
+              status_code=200, headers={'Content-Type': 'application/json'})
+
+    job = actions.preview(source.slug)
+
+    assert rmock.call_count == 1
+    assert rmock.last_request.qs['rows'] == ['2']
+    assert job.status == 'done'
+    assert [item.remote_id for item in job.items] == [p['id'] for p in packages]
+    assert Dataset.objects.count() == 0
+
+
+def test_extras_aliases(app, rmock):
+    '''CKAN Harvester should handle aliased extras as the known ones'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    package = ckan_package({
+        'name': faker.unique_string(),
+        'title': faker.sentence(),
+        'notes': faker.paragraph(),
+        'resources': [{'url': faker.unique_url(), 'format': 'csv', 'name': faker.word(),
+                       'description': None, 'mimetype': None, 'size': None, 'hash': None,
+                       'position': 0}],
+        'extras': [
+            {'key': 'update_frequency', 'value': 'http://purl.org/cld/freq/daily'},
+            {'key': 'other', 'value': 'value'},
+        ],
+    })
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'extra_configs': [{'key': 'extras_aliases', 'value': 'update_frequency=frequency'}],
+    })
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': [package['result']['name']]},
+              status_code=200, headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_SHOW_URL, json=package, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+
+    dataset = dataset_for(package)
+    assert dataset.frequency == 'daily'
+    assert 'update_frequency' not in dataset.extras
+    assert dataset.extras['other'] == 'value'
+
+
+def test_spatial_pipeline(app, rmock):
+    '''CKAN Harvester should simplify geometries when the spatial pipeline is enabled'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    # A square polygon with a useless position in the middle of each side
+    polygon = {'type': 'Polygon', 'coordinates': [[
+        [0, 0], [0.5, 0], [1, 0], [1, 0.5], [1, 1], [0.5, 1], [0, 1], [0, 0.5], [0, 0]
+    ]]}
+    package = ckan_package({
+        'name': faker.unique_string(),
+        'title': faker.sentence(),
+        'notes': faker.paragraph(),
+        'resources': [{'url': faker.unique_url(), 'format': 'csv', 'name': faker.word(),
+                       'description': None, 'mimetype': None, 'size': None, 'hash': None,
+                       'position': 0}],
+        'extras': [{'key': 'spatial', 'value': json.dumps(polygon)}],
+    })
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'features': {'spatial_pipeline': True},
+    })
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': [package['result']['name']]},
+              status_code=200, headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_SHOW_URL, json=package, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    dataset = dataset_for(package)
+    assert dataset.spatial.geom == {
+        'type': 'MultiPolygon',
+        'coordinates': [[[[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]]],
+    }
+    metrics = source.get_last_job().data['spatial']
+    assert metrics['simplified'] == 1
+    assert metrics['bytes_out'] < metrics['bytes_in']
+
+
+def test_compressed_responses(app, rmock):
+    '''CKAN Harvester should negotiate compression and account transferred bytes'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+
+    body = json.dumps({'success': True, 'result': []}).encode() + b' ' * 1000
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, content=gzip.compress(body), status_code=200,
+              headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+    actions.run(source.slug)
+    source.reload()
+
+    assert 'gzip' in rmock.last_request.headers['Accept-Encoding']
+    job = source.get_last_job()
+    assert job.status == 'done'
+    transfer = job.data['transfer']['package_list']
+    assert transfer['requests'] == 1
+    assert transfer['decoded'] == len(body)
+    assert transfer['wire'] < transfer['decoded']
+    assert transfer['time'] >= 0
+    assert sum(job.data['latency']['package_list']) == 1
+    assert job.data['throughput']['items'] == 0
+
+
+def test_activity_sync(app, rmock):
+    '''CKAN Harvester should only process changed packages since the last run'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    ACTIVITY_URL = '{}recently_changed_packages_activity_list'.format(API_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    resource = {'url': faker.unique_url(), 'format': 'csv', 'name': faker.word(),
+                'description': None, 'mimetype': None, 'size': None, 'hash': None,
+                'position': 0}
+    package_a = ckan_package({'name': 'a', 'title': faker.sentence(), 'notes': None,
+                              'resources': [dict(resource)]})
+    package_b = ckan_package({'name': 'b', 'title': faker.sentence(), 'notes': None,
+                              'resources': [dict(resource, url=faker.unique_url())]})
+    id_a, id_b = package_a['result']['id'], package_b['result']['id']
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'features': {'activity_sync': True},
+    })
+
+    def activities(*items):
+        return [
+            {'json': {'success': True, 'result': list(items)}, 'status_code': 200,
+             'headers': {'Content-Type': 'application/json'}},
+            {'json': {'success': True, 'result': []}, 'status_code': 200,
+             'headers': {'Content-Type': 'application/json'}},
+        ]
+
+    # First run: full harvest recording the checkpoint
+    rmock.get(ACTIVITY_URL, activities(
+        {'timestamp': '2024-01-01T00:00:00', 'object_id': id_a, 'activity_type': 'new package'},
+    ))
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': ['a', 'b']}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    rmock.get(f'{PACKAGE_SHOW_URL}?id=a', json=package_a, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    rmock.get(f'{PACKAGE_SHOW_URL}?id=b', json=package_b, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    job = source.get_last_job()
+    assert len(job.items) == 2
+    assert job.data['activity_checkpoint'] == '2024-01-01T00:00:00'
+
+    # Second run: only changes since the checkpoint
+    rmock.reset_mock()
+    rmock.get(ACTIVITY_URL, activities(
+        {'timestamp': '2024-01-03T00:00:00', 'object_id': id_b, 'activity_type': 'changed package'},
+        {'timestamp': '2024-01-02T12:00:00', 'object_id': id_a, 'activity_type': 'deleted package'},
+        {'timestamp': '2024-01-02T00:00:00', 'object_id': id_b, 'activity_type': 'changed package'},
+        {'timestamp': '2024-01-01T00:00:00', 'object_id': id_a, 'activity_type': 'new package'},
+    ))
+    rmock.get(f'{PACKAGE_SHOW_URL}?id={id_b}', json=package_b, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert job.data['activity_checkpoint'] == '2024-01-03T00:00:00'
+    assert {(i.remote_id, i.status) for i in job.items} == {(id_b, 'done'), (id_a, 'archived')}
+    assert not any(r.path.endswith('package_list') for r in rmock.request_history)
+    assert dataset_for(package_a).archived is not None
+    assert dataset_for(package_b).archived is None
+
+
+def test_unchanged_resources_are_not_rewritten(app, rmock):
+    '''CKAN Harvester should only update resources changed since the last run'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    resource = {'format': 'csv', 'name': faker.word(), 'description': None,
+                'mimetype': None, 'size': None, 'hash': None, 'position': 0}
+    package = ckan_package({'name': 'a', 'title': faker.sentence(), 'notes': None,
+                            'resources': [dict(resource, url=faker.unique_url()),
+                                          dict(resource, url=faker.unique_url())]})
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': ['a']}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_SHOW_URL, json=package, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+    assert source.get_last_job().data['resources'] == {'created': 2}
+
+    # Locally edited resources are kept as long as their remote is not changed
+    dataset = dataset_for(package)
+    dataset.resources[0].title = 'local title'
+    dataset.save()
+    changed = package['result']['resources'][1]
+    changed['url'] = faker.unique_url()
+    actions.run(source.slug)
+    source.reload()
+
+    assert source.get_last_job().data['resources'] == {'unchanged': 1, 'updated': 1}
+    dataset = dataset_for(package)
+    assert len(dataset.resources) == 2
+    assert dataset.resources[0].title == 'local title'
+    assert dataset.resources[1].url == changed['url']
+
+
+def test_resources_mapped_again_on_mapping_change(app, rmock, monkeypatch):
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    resource = {'format': 'csv', 'name': faker.word(), 'description': None,
+                'mimetype': None, 'size': None, 'hash': None, 'position': 0,
+                'url': faker.unique_url()}
+    package = ckan_package({'name': 'a', 'title': faker.sentence(), 'notes': None,
+                            'resources': [resource]})
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': ['a']}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_SHOW_URL, json=package, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+
+    monkeypatch.setattr(harvesters, 'MAPPING_VERSION', harvesters.MAPPING_VERSION + 1)
+    actions.run(source.slug)
+    source.reload()
+
+    assert source.get_last_job().data['resources'] == {'updated': 1}
+
+
+def test_max_resources(app, rmock):
+    '''CKAN Harvester should only harvest the first `max_resources` resources'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    resource = {'format': 'csv', 'name': faker.word(), 'description': None,
+                'mimetype': None, 'size': None, 'hash': None, 'position': 0}
+    package = ckan_package({'name': 'a', 'title': faker.sentence(), 'notes': None,
+                            'resources': [dict(resource, url=faker.unique_url())
+                                          for _ in range(5)]})
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'extra_configs': [{'key': 'max_resources', 'value': 3}],
+    })
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': ['a']}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_SHOW_URL, json=package, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert job.data['resources'] == {'created': 3, 'overflow': 2}
+    item = job.items[0]
+    assert item.status == 'done'
+    assert item.errors[0].message == '2 resources over the 3 resources limit were not harvested'
+    assert len(dataset_for(package).resources) == 3
+
+
+def test_invalid_resource_error_path(app, rmock):
+    '''CKAN Harvester should report invalid resources with their position'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    resource = {'format': 'csv', 'name': faker.word(), 'description': None,
+                'mimetype': None, 'size': None, 'hash': None, 'position': 0}
+    package = ckan_package({'name': 'a', 'title': faker.sentence(), 'notes': None,
+                            'resources': [dict(resource, url=faker.unique_url()),
+                                          dict(resource, url='not-an-url')]})
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': ['a']}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_SHOW_URL, json=package, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    item = source.get_last_job().items[0]
+    assert item.status == 'failed'
+    assert '[resources.1.url]' in item.errors[0].message
+
+
+def test_validation_errors_summary(app, rmock):
+    '''CKAN Harvester should group validation errors in the job data'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    resource = {'format': 'csv', 'name': faker.word(), 'description': None,
+                'mimetype': None, 'size': None, 'hash': None, 'position': 0,
+                'url': 'not-an-url'}
+    packages = {
+        'a': ckan_package({'name': 'a', 'title': faker.sentence(), 'notes': None,
+                           'resources': [dict(resource)]}),
+        'b': ckan_package({'name': 'b', 'title': faker.sentence(), 'notes': None,
+                           'resources': [dict(resource, url=faker.unique_url()),
+                                         dict(resource)]}),
+        'c': ckan_package({'name': 'c', 'title': None, 'notes': None,
+                           'resources': [dict(resource, url=faker.unique_url())]}),
+    }
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': list(packages)},
+              status_code=200, headers={'Content-Type': 'application/json'})
+    for name, package in packages.items():
+        rmock.get(f'{PACKAGE_SHOW_URL}?id={name}', json=package, status_code=200,
+                  headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    job = source.get_last_job()
+    assert job.data['validation'] == {'errors': 3}
+    url_errors, title_errors = job.data['validation_errors']
+    assert url_errors['path'] == 'resources.*.url'
+    assert url_errors['count'] == 2
+    assert url_errors['sample'] == [packages['a']['result']['id'], packages['b']['result']['id']]
+    assert 'not-an-url' in url_errors['message']
+    assert title_errors == {
+        'path': 'title',
+        'error': 'TypeInvalid',
+        'message': 'expected str',
+        'count': 1,
+        'sample': [packages['c']['result']['id']],
+    }
+
+
+def test_failure_cache(app, rmock, monkeypatch):
+    '''CKAN Harvester should not process again unchanged failing packages'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_SEARCH_URL = '{}package_search'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    monkeypatch.setattr(harvesters, 'cache', SimpleCache())
+    package = ckan_package({'name': 'a', 'title': faker.sentence(), 'notes': None,
+                            'resources': []})
+    listed = {key: package['result'][key] for key in ('id', 'name', 'metadata_modified')}
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'features': {'failure_cache': True},
+    })
+
+    def listing():
+        return {'success': True, 'result': {'count': 1, 'results': [listed]}}
+
+    rmock.get(PACKAGE_SEARCH_URL, json=listing(), status_code=200,
+              headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_SHOW_URL, json=package, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+    item = source.get_last_job().items[0]
+    assert item.status == 'skipped'
+    assert rmock.call_count == 2
+
+    # Unchanged: skipped without fetching it again
+    rmock.reset_mock()
+    actions.run(source.slug)
+    source.reload()
+    job = source.get_last_job()
+    assert job.items[0].status == 'skipped'
+    assert job.items[0].errors[0].message == item.errors[0].message
+    assert job.data['failures'] == {'cached': 1}
+    assert not any(r.path.endswith('package_show') for r in rmock.request_history)
+
+    # Modified: processed again
+    rmock.reset_mock()
+    listed['metadata_modified'] = '2030-01-01T00:00:00'
+    rmock.get(PACKAGE_SEARCH_URL, json=listing(), status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+    assert any(r.path.endswith('package_show') for r in rmock.request_history)
+
+
+def test_failure_cache_ignores_transient_errors(app, rmock, monkeypatch):
+    '''CKAN Harvester should not remember transient failures'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_SEARCH_URL = '{}package_search'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    monkeypatch.setattr(harvesters, 'cache', SimpleCache())
+    package = ckan_package({'name': 'a', 'title': faker.sentence(), 'notes': None})
+    listed = {key: package['result'][key] for key in ('id', 'name', 'metadata_modified')}
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'features': {'failure_cache': True},
+    })
+    rmock.get(PACKAGE_SEARCH_URL, json={'success': True, 'result': {
+        'count': 1, 'results': [listed],
+    }}, status_code=200, headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_SHOW_URL, text='Bad gateway', status_code=502)
+
+    actions.run(source.slug)
+    source.reload()
+    assert source.get_last_job().items[0].status == 'failed'
+
+    rmock.reset_mock()
+    actions.run(source.slug)
+    source.reload()
+    assert 'failures' not in source.get_last_job().data
+    assert any(r.path.endswith('package_show') for r in rmock.request_history)
+
+
+@pytest.mark.options(HARVEST_AUTOARCHIVE_GRACE_DAYS=-1)
+def test_incomplete_listing_is_not_archived(app, rmock, monkeypatch):
+    '''CKAN Harvester should not archive datasets when the listing ended early'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_SEARCH_URL = '{}package_search'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    monkeypatch.setattr(CkanBackend, 'page_size', 1)
+    packages = [ckan_package({'name': name, 'title': faker.sentence(), 'notes': None,
+                              'resources': [{'url': faker.unique_url(), 'format': 'csv',
+                                             'name': faker.word(), 'position': 0,
+                                             'description': None, 'mimetype': None,
+                                             'size': None, 'hash': None}]})
+                for name in ('a', 'b')]
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'filters': [{'key': 'organization', 'value': 'org'}],
+    })
+
+    def page(*packages):
+        return {'json': {'success': True, 'result': {'count': 2, 'results': [
+            {key: p['result'][key] for key in ('id', 'name', 'metadata_modified')}
+            for p in packages
+        ]}}, 'status_code': 200, 'headers': {'Content-Type': 'application/json'}}
+
+    rmock.get(PACKAGE_SEARCH_URL, [page(packages[0]), page(packages[1])])
+    for package in packages:
+        rmock.get(f"{PACKAGE_SHOW_URL}?id={package['result']['name']}", json=package,
+                  status_code=200, headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    assert Dataset.objects(harvest__source_id=str(source.id), archived=None).count() == 2
+
+    # The server ignores `start` and returns the first page again
+    rmock.get(PACKAGE_SEARCH_URL, [page(packages[0])])
+    actions.run(source.slug)
+    source.reload()
+
+    job = source.get_last_job()
+    assert [i.status for i in job.items] == ['done']
+    assert Dataset.objects(harvest__source_id=str(source.id), archived=None).count() == 2
+
+
+def test_probe_capabilities(app, rmock, monkeypatch):
+    '''CKAN Harvester should probe the remote capabilities once and use them'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    STATUS_SHOW_URL = '{}status_show'.format(API_URL)
+    PACKAGE_SEARCH_URL = '{}package_search'.format(API_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+
+    monkeypatch.setattr(harvesters, 'cache', SimpleCache())
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'features': {'probe': True},
+    })
+    rmock.get(STATUS_SHOW_URL, json={'success': True, 'result': {'ckan_version': '2.9.5'}},
+              status_code=200, headers={'Content-Type': 'application/json'})
+    # Full packages are returned: `fl` is not supported
+    rmock.get(PACKAGE_SEARCH_URL, json={'success': True, 'result': {
+        'count': 1, 'results': [minimal_data()],
+    }}, status_code=200, headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': []}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    capabilities = source.get_last_job().data['capabilities']
+    assert capabilities['version'] == '2.9.5'
+    assert capabilities['fl'] is False
+    assert capabilities['latency'] is not None
+
+    # Capabilities are cached
+    rmock.reset_mock()
+    actions.run(source.slug)
+    source.reload()
+    assert source.get_last_job().data['capabilities'] == capabilities
+    assert [r.path for r in rmock.request_history] == ['/api/3/action/package_list']
+
+
+def test_probe_search_parameters(app, rmock, monkeypatch):
+    '''CKAN Harvester should adapt its listing to the probed search capabilities'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    STATUS_SHOW_URL = '{}status_show'.format(API_URL)
+    PACKAGE_SEARCH_URL = '{}package_search'.format(API_URL)
+
+    monkeypatch.setattr(harvesters, 'cache', SimpleCache())
+    monkeypatch.setattr(CkanBackend, 'page_size', 3)
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'features': {'probe': True, 'failure_cache': True},
+    })
+    rmock.get(STATUS_SHOW_URL, json={'success': True, 'result': {'ckan_version': '2.8.1'}},
+              status_code=200, headers={'Content-Type': 'application/json'})
+    listed = [{'id': faker.uuid4(), 'name': faker.unique_string(), 'metadata_modified': None}
+              for _ in range(3)]
+
+    def search(request, context):
+        context.headers['Content-Type'] = 'application/json'
+        if 'fq' in request.qs:
+            context.status_code = 409
+            return {'success': False, 'error': {'message': 'Search error'}}
+        # `ckan.search.rows_max` is 2
+        start = int(request.qs.get('start', ['0'])[0])
+        rows = min(int(request.qs['rows'][0]), 2)
+        return {'success': True, 'result': {'count': 3, 'results': listed[start:start + rows]}}
+
+    rmock.get(PACKAGE_SEARCH_URL, json=search)
+    rmock.get('{}package_show'.format(API_URL), status_code=404,
+              json={'success': False, 'error': 'Not found'},
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    job = source.get_last_job()
+    assert job.data['capabilities']['fl'] is True
+    assert job.data['capabilities']['fq'] is False
+    assert job.data['capabilities']['sort'] is True
+    assert job.data['capabilities']['rows_max'] == 2
+    listing = [r.qs for r in rmock.request_history
+               if r.path.endswith('package_search') and r.qs.get('sort')][-2:]
+    assert [qs['rows'] for qs in listing] == [['2'], ['2']]
+    assert len(job.items) == 3
+
+
+def test_probe_not_cached_on_network_error(app, rmock, monkeypatch):
+    '''CKAN Harvester should probe again after a probe failing on network errors'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+
+    monkeypatch.setattr(harvesters, 'cache', SimpleCache())
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'features': {'probe': True},
+    })
+    rmock.get('{}status_show'.format(API_URL), exc=requests.exceptions.ConnectTimeout)
+    rmock.get('{}api/util/status'.format(CKAN_URL), exc=requests.exceptions.ConnectTimeout)
+    rmock.get('{}package_search'.format(API_URL), exc=requests.exceptions.ConnectTimeout)
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': []}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    assert source.get_last_job().data['capabilities']['fl'] is None
+    assert harvesters.cache.get('udata-ckan:capabilities:{0}'.format(source.id)) is None
+
+
+def test_probe_legacy_ckan(app, rmock):
+    '''CKAN Harvester should use POST requests on CKAN < 1.8'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'features': {'probe': True},
+    })
+    rmock.get('{}api/util/status'.format(CKAN_URL), json={'ckan_version': '1.7.1'},
+              status_code=200, headers={'Content-Type': 'application/json'})
+    rmock.post(PACKAGE_LIST_URL, json={'success': True, 'result': []}, status_code=200,
+               headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert job.data['capabilities']['version'] == '1.7.1'
+    assert rmock.last_request.method == 'POST'
+
+
+def test_tags_are_normalized_once_and_deduplicated(app, rmock):
+    '''CKAN Harvester should memoize tags normalization and deduplicate tags'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    resource = {'format': 'csv', 'name': faker.word(), 'description': None,
+                'mimetype': None, 'size': None, 'hash': None, 'position': 0}
+    tags = [{'id': faker.uuid4(), 'name': name} for name in ('Open Data', 'open-data', 'other')]
+    packages = {
+        name: ckan_package({'name': name, 'title': faker.sentence(), 'notes': None,
+                            'tags': tags, 'resources': [dict(resource, url=faker.unique_url())]})
+        for name in ('a', 'b')
+    }
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': list(packages)},
+              status_code=200, headers={'Content-Type': 'application/json'})
+    for name, package in packages.items():
+        rmock.get(f'{PACKAGE_SHOW_URL}?id={name}', json=package, status_code=200,
+                  headers={'Content-Type': 'application/json'})
+    hits = normalize_tag.cache_info().hits
+    actions.run(source.slug)
+    source.reload()
+
+    job = source.get_last_job()
+    assert job.status == 'done'
+    # Second package tags are all cached
+    assert normalize_tag.cache_info().hits - hits >= 3
+    assert dataset_for(packages['a']).tags == ['open-data', 'other']
+
+
+def test_organizations_are_validated_once(app, rmock):
+    '''CKAN Harvester should only validate an organization on its first occurrence'''
+    CKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(CKAN_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    resource = {'format': 'csv', 'name': faker.word(), 'description': None,
+                'mimetype': None, 'size': None, 'hash': None, 'position': 0}
+    organization = {
+        'id': faker.uuid4(), 'name': 'org', 'title': 'Org', 'description': '',
+        'created': faker.iso8601(), 'revision_timestamp': faker.iso8601(),
+        'is_organization': True, 'state': 'active', 'image_url': '',
+        'revision_id': faker.uuid4(), 'type': 'organization', 'approval_status': 'approved',
+    }
+    organizations = {
+        'a': organization,
+        'b': organization,
+        # Changed organizations are validated again
+        'c': dict(organization, approval_status='pending'),
+    }
+    packages = {
+        name: ckan_package({'name': name, 'title': faker.sentence(), 'notes': None,
+                            'organization': org,
+                            'resources': [dict(resource, url=faker.unique_url())]})
+        for name, org in organizations.items()
+    }
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': list(packages)},
+              status_code=200, headers={'Content-Type': 'application/json'})
+    for name, package in packages.items():
+        rmock.get(f'{PACKAGE_SHOW_URL}?id={name}', json=package, status_code=200,
+                  headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+
+    job = source.get_last_job()
+    assert [item.status for item in job.items] == ['done', 'done', 'failed']
+    assert 'organization.approval_status' in job.items[2].errors[0].message
+    assert job.data['references'] == {'cached': 1}
+
+
 def minimal_data(**kwargs):
     # extras and revision_id are not always present so we exclude them
     # from the minimal payload
@@ -56,7 +56,7 @@ def test_plain_text_error(rmock, code):
     error = job.errors[0]
     # Raw quoted string is properly unquoted
     http_message = "Server Error" if code == 500 else "Client Error"
-    assert error.message == f'{code} {http_message}: None for url: https://harvest.me/api/3/action/package_list'
+    assert error.message == f'{code} {http_message}: None for url: https://harvest.me/api/3/action/package_list?limit=1000'
 
 def test_200_plain_text_error(rmock):
     source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
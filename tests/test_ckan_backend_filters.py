@@ -25,8 +25,10 @@ def test_include_org_filter(ckan, rmock):
 
     assert rmock.call_count == 1
     params = {
-        'q': f'organization:organization_name',
-        'rows': 1000
+        'fq': f'+organization:organization_name',
+        'rows': 1000,
+        'sort': 'id asc',
+        'fl': 'id,name,metadata_modified',
     }
     assert rmock.last_request.url == f'{ckan.PACKAGE_SEARCH_URL}?{urllib.parse.urlencode(params)}'
 
@@ -45,8 +47,10 @@ def test_exclude_org_filter(ckan, rmock):
     assert rmock.call_count == 1
 
     params = {
-        'q': f'-organization:organization_name',
-        'rows': 1000
+        'fq': f'-organization:organization_name',
+        'rows': 1000,
+        'sort': 'id asc',
+        'fl': 'id,name,metadata_modified',
     }
     assert rmock.last_request.url == f'{ckan.PACKAGE_SEARCH_URL}?{urllib.parse.urlencode(params)}'
 
@@ -66,8 +70,10 @@ def test_tag_filter(ckan, rmock):
 
     assert rmock.call_count == 1
     params = {
-        'q': f'tags:{tag}',
-        'rows': 1000
+        'fq': f'+tags:{tag}',
+        'rows': 1000,
+        'sort': 'id asc',
+        'fl': 'id,name,metadata_modified',
     }
     assert rmock.last_request.url == f'{ckan.PACKAGE_SEARCH_URL}?{urllib.parse.urlencode(params)}'
 
@@ -86,12 +92,41 @@ def test_exclude_tag_filter(ckan, rmock):
 
     assert rmock.call_count == 1
     params = {
-        'q': f'-tags:{tag}',
-        'rows': 1000
+        'fq': f'-tags:{tag}',
+        'rows': 1000,
+        'sort': 'id asc',
+        'fl': 'id,name,metadata_modified',
     }
     assert rmock.last_request.url == f'{ckan.PACKAGE_SEARCH_URL}?{urllib.parse.urlencode(params)}'
 
 
+def test_search_without_fl_support(ckan, rmock):
+    source = HarvestSourceFactory(backend='ckan', url=ckan.BASE_URL, config={
+        'filters': [{'key': 'organization', 'value': 'organization_name'}]
+    })
+
+    error = {'json': {'success': False, 'error': {'message': 'Search error'}},
+             'status_code': 200, 'headers': {'Content-Type': 'application/json'}}
+    rmock.get(ckan.PACKAGE_SEARCH_URL, [
+        error,
+        error,
+        {'json': {'success': True, 'result': {'results': []}},
+         'status_code': 200, 'headers': {'Content-Type': 'application/json'}},
+    ])
+
+    actions.run(source.slug)
+    source.reload()
+
+    assert rmock.call_count == 3
+    assert 'fl' in rmock.request_history[0].qs
+    # `q` is tried first, before dropping `fl`
+    assert 'q' in rmock.request_history[1].qs
+    assert 'fl' in rmock.request_history[1].qs
+    assert 'fl' not in rmock.last_request.qs
+    assert 'fq' in rmock.last_request.qs
+    assert source.get_last_job().status == 'done'
+
+
 def test_can_have_multiple_filters(ckan, rmock):
     source = HarvestSourceFactory(backend='ckan', url=ckan.BASE_URL, config={
         'filters': [
@@ -108,7 +143,58 @@ def test_can_have_multiple_filters(ckan, rmock):
 
     assert rmock.call_count == 1
     params = {
-        'q': f'organization:organization_name AND -tags:tag-2',
-        'rows': 1000
+        'fq': f'+organization:organization_name -tags:tag-2',
+        'rows': 1000,
+        'sort': 'id asc',
+        'fl': 'id,name,metadata_modified',
     }
     assert rmock.last_request.url == f'{ckan.PACKAGE_SEARCH_URL}?{urllib.parse.urlencode(params)}'
+
+
+def test_any_filters_are_alternatives(ckan, rmock):
+    source = HarvestSourceFactory(backend='ckan', url=ckan.BASE_URL, config={
+        'filters': [
+            {'key': 'organization', 'value': 'org-1', 'type': 'any'},
+            {'key': 'organization', 'value': 'org 2', 'type': 'any'},
+            {'key': 'modified_since', 'value': '2024-01-31'},
+        ]
+    })
+
+    rmock.get(ckan.PACKAGE_SEARCH_URL, json={'success': True, 'result': {"results": []}},
+              status_code=200, headers={'Content-Type': 'application/json'})
+
+    actions.run(source.slug)
+    source.reload()
+
+    assert rmock.call_count == 1
+    params = {
+        'fq': '+organization:(org-1 OR "org 2") +metadata_modified:[2024-01-31T00:00:00Z TO *]',
+        'rows': 1000,
+        'sort': 'id asc',
+        'fl': 'id,name,metadata_modified',
+    }
+    assert rmock.last_request.url == f'{ckan.PACKAGE_SEARCH_URL}?{urllib.parse.urlencode(params)}'
+
+
+def test_search_without_fq_support(ckan, rmock):
+    source = HarvestSourceFactory(backend='ckan', url=ckan.BASE_URL, config={
+        'filters': [{'key': 'organization', 'value': 'organization_name'}]
+    })
+
+    rmock.get(ckan.PACKAGE_SEARCH_URL, [
+        {'json': {'success': False, 'error': {'message': 'Search error'}},
+         'status_code': 200, 'headers': {'Content-Type': 'application/json'}},
+        {'json': {'success': True, 'result': {'results': []}},
+         'status_code': 200, 'headers': {'Content-Type': 'application/json'}},
+    ])
+
+    actions.run(source.slug)
+    source.reload()
+
+    assert rmock.call_count == 2
+    assert 'fq' in rmock.request_history[0].qs
+    assert rmock.last_request.qs['q'] == ['+organization:organization_name']
+    assert 'fq' not in rmock.last_request.qs
+    # `fl` is still used
+    assert 'fl' in rmock.last_request.qs
+    assert source.get_last_job().status == 'done'
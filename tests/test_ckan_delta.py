@@ -0,0 +1,178 @@
+import threading
+
+import pytest
+
+from cachelib import SimpleCache
+
+from udata.harvest.models import HarvestJob, HarvestSource
+from udata.harvest.tests.factories import HarvestSourceFactory
+from udata.utils import faker
+
+from udata_ckan import harvesters
+from udata_ckan.harvesters import CkanBackend
+from udata_ckan.tasks import harvest_delta
+
+
+pytestmark = [
+    pytest.mark.usefixtures('clean_db'),
+    pytest.mark.options(PLUGINS=['ckan']),
+]
+
+CKAN_URL = 'https://harvest.me/'
+API_URL = '{}api/3/action/'.format(CKAN_URL)
+ACTIVITY_URL = '{}recently_changed_packages_activity_list'.format(API_URL)
+PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+CHECKPOINT = '2024-01-01T00:00:00'
+
+
+def json_response(result):
+    return {'json': {'success': True, 'result': result}, 'status_code': 200,
+            'headers': {'Content-Type': 'application/json'}}
+
+
+@pytest.fixture
+def source():
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    HarvestJob.objects.create(source=source, status='done',
+                              data={'activity_checkpoint': CHECKPOINT})
+    return source
+
+
+def test_delta_harvest(source, rmock):
+    first, second = faker.ckan_package(), faker.ckan_package()
+    rmock.get(ACTIVITY_URL, [
+        json_response([
+            {'timestamp': '2024-01-03T00:00:00', 'object_id': second['id'],
+             'activity_type': 'changed package'},
+            {'timestamp': '2024-01-02T00:00:00', 'object_id': first['id'],
+             'activity_type': 'new package'},
+            {'timestamp': CHECKPOINT, 'object_id': first['id'],
+             'activity_type': 'new package'},
+        ]),
+        json_response([]),
+    ])
+    for pkg in first, second:
+        rmock.get(f"{PACKAGE_SHOW_URL}?id={pkg['id']}", **json_response(pkg))
+
+    harvest_delta(str(source.id))
+
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert [i.remote_id for i in job.items] == [first['id'], second['id']]
+    assert job.data['activity_checkpoint'] == '2024-01-03T00:00:00'
+
+
+def test_delta_harvest_keeps_failed_changes(source, rmock):
+    first, second = faker.ckan_package(), faker.ckan_package()
+    rmock.get(ACTIVITY_URL, [
+        json_response([
+            {'timestamp': '2024-01-03T00:00:00', 'object_id': second['id'],
+             'activity_type': 'changed package'},
+            {'timestamp': '2024-01-02T00:00:00', 'object_id': first['id'],
+             'activity_type': 'changed package'},
+        ]),
+        json_response([]),
+    ])
+    rmock.get(f"{PACKAGE_SHOW_URL}?id={first['id']}", text='Bad gateway', status_code=502)
+    rmock.get(f"{PACKAGE_SHOW_URL}?id={second['id']}", **json_response(second))
+
+    harvest_delta(str(source.id))
+
+    job = source.get_last_job()
+    assert job.status == 'done-errors'
+    assert [i.status for i in job.items] == ['failed', 'done']
+    # The failed change is retried by the next run
+    assert job.data['activity_checkpoint'] == CHECKPOINT
+
+
+def test_delta_harvest_without_checkpoint(rmock):
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+
+    harvest_delta(str(source.id))
+
+    assert rmock.call_count == 0
+    assert HarvestJob.objects(source=source).count() == 0
+
+
+def test_delta_harvest_skipped_during_full_harvest(source, rmock, monkeypatch):
+    monkeypatch.setattr(harvesters, 'cache', SimpleCache())
+    lock_key = 'udata-ckan:harvest-lock:{0}:full'.format(source.id)
+    locks = []
+
+    def listing(request, context):
+        # A delta harvest scheduled while the full harvest runs
+        harvest_delta(str(source.id))
+        locks.append(harvesters.cache.get(lock_key))
+        return {'success': True, 'result': []}
+
+    rmock.get(PACKAGE_LIST_URL, json=listing, status_code=200,
+              headers={'Content-Type': 'application/json'})
+
+    CkanBackend(source).harvest()
+
+    assert not any(r.path.endswith('activity_list') for r in rmock.request_history)
+    # The full harvest lock outlived the skipped delta
+    assert locks[0].startswith('full:')
+    assert harvesters.cache.get(lock_key) is None
+    assert HarvestJob.objects(source=source).count() == 2
+
+
+def test_full_harvest_waits_for_delta(app, source, rmock, monkeypatch):
+    monkeypatch.setattr(harvesters, 'cache', SimpleCache())
+    monkeypatch.setattr(harvesters, 'LOCK_POLL_INTERVAL', 0.01)
+    full_key = 'udata-ckan:harvest-lock:{0}:full'.format(source.id)
+    pkg = faker.ckan_package()
+    events = []
+
+    def full_harvest():
+        with app.app_context():
+            CkanBackend(HarvestSource.objects.get(id=source.id)).harvest()
+
+    def show(request, context):
+        # A full harvest starting while the delta harvest runs
+        thread = threading.Thread(target=full_harvest)
+        thread.start()
+        thread.join(0.3)
+        events.append(('full running', thread.is_alive()))
+        show.thread = thread
+        return {'success': True, 'result': pkg}
+
+    def listing(request, context):
+        events.append(('full listing', harvesters.cache.get(full_key).startswith('full:')))
+        return {'success': True, 'result': []}
+
+    rmock.get(ACTIVITY_URL, [
+        json_response([{'timestamp': '2024-01-02T00:00:00', 'object_id': pkg['id'],
+                        'activity_type': 'new package'}]),
+        json_response([]),
+    ])
+    rmock.get(f"{PACKAGE_SHOW_URL}?id={pkg['id']}", json=show, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_LIST_URL, json=listing, status_code=200,
+              headers={'Content-Type': 'application/json'})
+
+    harvest_delta(str(source.id))
+    show.thread.join(5)
+
+    # The full harvest waited for the delta end, which kept its lock
+    assert events == [('full running', True), ('full listing', True)]
+    assert harvesters.cache.get(full_key) is None
+
+
+@pytest.mark.options(CKAN_DELTA_TIME_BUDGET=0)
+def test_delta_harvest_time_budget(source, rmock):
+    pkg = faker.ckan_package()
+    rmock.get(ACTIVITY_URL, [
+        json_response([{'timestamp': '2024-01-02T00:00:00', 'object_id': pkg['id'],
+                        'activity_type': 'new package'}]),
+        json_response([]),
+    ])
+
+    harvest_delta(str(source.id))
+
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert len(job.items) == 0
+    # Nothing processed: next run starts again from the previous checkpoint
+    assert 'activity_checkpoint' not in job.data
@@ -0,0 +1,168 @@
+import gzip
+import json
+import pstats
+
+import pytest
+
+from udata.harvest.models import HarvestJob
+from udata.harvest.tests.factories import HarvestSourceFactory
+from udata.models import Dataset
+from udata.utils import faker
+
+
+pytestmark = [
+    pytest.mark.usefixtures('clean_db'),
+    pytest.mark.options(PLUGINS=['ckan']),
+]
+
+CKAN_URL = 'https://harvest.me/'
+API_URL = '{}api/3/action/'.format(CKAN_URL)
+PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+PACKAGE_SEARCH_URL = '{}package_search'.format(API_URL)
+PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+
+def test_profile(cli, rmock, tmp_path):
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': ['a']}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_SHOW_URL, json={'success': False, 'error': 'Not found'}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+
+    cli('ckan', 'profile', source.slug, '--output', str(tmp_path))
+
+    job = source.get_last_job()
+    profile = job.data['profile']
+    assert profile['datasets'] == 1
+    assert pstats.Stats(profile['cpu']).total_calls > 0
+    assert (tmp_path / '{0}-{1}-memory.txt'.format(source.slug, job.id)).exists()
+    with open(profile['report']) as report:
+        report = json.load(report)
+    assert [d['remote_id'] for d in report['slowest']] == ['a']
+    assert report['hungriest'][0]['peak'] >= 0
+
+
+def test_replay(cli, rmock, tmp_path):
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    packages = [faker.ckan_package(), faker.ckan_package()]
+    path = tmp_path / 'dump.jsonl.gz'
+    path.write_bytes(gzip.compress(
+        b''.join(json.dumps(p).encode() + b'\n' for p in packages)
+    ))
+
+    cli('ckan', 'replay', source.slug, str(path))
+
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert [item.remote_id for item in job.items] == [p['id'] for p in packages]
+    assert Dataset.objects(harvest__source_id=str(source.id)).count() == 2
+    assert not rmock.called
+
+
+def test_replay_maps_unchanged_resources(cli, tmp_path):
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    path = tmp_path / 'dump.jsonl'
+    path.write_bytes(json.dumps(faker.ckan_package()).encode() + b'\n')
+
+    cli('ckan', 'replay', source.slug, str(path))
+    cli('ckan', 'replay', source.slug, str(path))
+
+    assert source.get_last_job().data['resources'] == {'updated': 1}
+
+
+@pytest.mark.options(HARVEST_AUTOARCHIVE_GRACE_DAYS=-1)
+def test_replay_does_not_archive(cli, tmp_path):
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    packages = [faker.ckan_package(), faker.ckan_package()]
+    for name, dumped in ('full', packages), ('partial', packages[:1]):
+        path = tmp_path / '{0}.jsonl'.format(name)
+        path.write_bytes(b''.join(json.dumps(p).encode() + b'\n' for p in dumped))
+        cli('ckan', 'replay', source.slug, str(path))
+
+    assert [item.status for item in source.get_last_job().items] == ['done']
+    assert Dataset.objects(harvest__source_id=str(source.id), archived=None).count() == 2
+
+
+def test_snapshot_and_replay(cli, rmock, tmp_path):
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    # Valid, without resource and with an invalid resource
+    packages = [faker.ckan_package(), faker.ckan_package(resources=[]), faker.ckan_package()]
+    del packages[2]['resources'][0]['url']
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': [p['name'] for p in packages]},
+              status_code=200, headers={'Content-Type': 'application/json'})
+    for p in packages:
+        rmock.get('{0}?id={1}'.format(PACKAGE_SHOW_URL, p['name']),
+                  json={'success': True, 'result': p}, status_code=200,
+                  headers={'Content-Type': 'application/json'})
+    path = tmp_path / 'snapshot.jsonl.gz'
+
+    cli('ckan', 'snapshot', source.slug, str(path), '--dryrun')
+
+    assert Dataset.objects.count() == 0
+    rmock.reset_mock()
+    cli('ckan', 'replay', source.slug, str(path))
+
+    assert not rmock.called
+    job = source.get_last_job()
+    assert [item.remote_id for item in job.items] == [packages[0]['id']]
+    dataset = Dataset.objects.get(harvest__remote_id=packages[0]['id'])
+    assert [r.url for r in dataset.resources] == [packages[0]['resources'][0]['url']]
+
+
+def test_shards(cli, rmock):
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    packages = sorted((faker.ckan_package() for _ in range(6)), key=lambda p: p['id'])
+    rmock.get(PACKAGE_SEARCH_URL, json={'success': True, 'result': {
+        'count': len(packages),
+        'results': [{key: p[key] for key in ('id', 'name', 'metadata_modified')}
+                    for p in packages],
+    }}, status_code=200, headers={'Content-Type': 'application/json'})
+    for p in packages:
+        rmock.get('{0}?id={1}'.format(PACKAGE_SHOW_URL, p['name']),
+                  json={'success': True, 'result': p}, status_code=200,
+                  headers={'Content-Type': 'application/json'})
+
+    harvested = []
+    for index in range(3):
+        cli('ckan', 'shard', source.slug, str(index), '3')
+        job = source.get_last_job()
+        assert job.status == 'done'
+        assert job.data.get('shard', {}).get('others', 0) == 6 - len(job.items)
+        assert rmock.request_history[0].qs['sort'] == ['id asc']
+        harvested.extend(item.remote_id for item in job.items)
+        rmock.reset_mock()
+
+    assert sorted(harvested) == [p['id'] for p in packages]
+    # Other shards datasets are not archived
+    assert Dataset.objects(harvest__source_id=str(source.id),
+                           harvest__archived_at=None).count() == 6
+
+
+def test_shard_ignores_activity_sync(cli, rmock):
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL, config={
+        'features': {'activity_sync': True},
+    })
+    HarvestJob.objects.create(source=source, status='done',
+                              data={'activity_checkpoint': '2024-01-01T00:00:00'})
+    rmock.get(PACKAGE_SEARCH_URL, json={'success': True, 'result': {'count': 0, 'results': []}},
+              status_code=200, headers={'Content-Type': 'application/json'})
+
+    cli('ckan', 'shard', source.slug, '0', '2')
+
+    assert [r.path for r in rmock.request_history] == ['/api/3/action/package_search']
+    assert 'activity_checkpoint' not in source.get_last_job().data
+
+
+def test_shard_out_of_range(cli):
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    result = cli('ckan', 'shard', source.slug, '2', '2', check=False)
+    assert result.exit_code != 0
+
+
+def test_bench_json(cli, tmp_path):
+    path = tmp_path / 'page.json'
+    path.write_text(json.dumps({'success': True, 'result': {'results': [faker.ckan_package()]}}))
+
+    result = cli('ckan', 'bench-json', str(path), '-n', '2')
+
+    assert result.exit_code == 0
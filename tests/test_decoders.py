@@ -0,0 +1,27 @@
+import math
+
+from udata_ckan import decoders
+
+
+def test_loads_bytes_and_str():
+    document = '{"name": "café", "count": 2}'
+    assert decoders.loads(document.encode('utf-8')) == {'name': 'café', 'count': 2}
+    assert decoders.loads(document) == {'name': 'café', 'count': 2}
+
+
+def test_loads_falls_back_on_stdlib():
+    # orjson rejects NaN which the standard library accepts
+    assert math.isnan(decoders.loads(b'{"value": NaN}')['value'])
+    assert decoders.loads('{"a": 1}'.encode('utf-16')) == {'a': 1}
+
+
+def test_loads_without_orjson(monkeypatch):
+    monkeypatch.setattr(decoders, 'orjson', None)
+    assert decoders.loads(b'[1, 2]') == [1, 2]
+
+
+def test_benchmark():
+    timings = decoders.benchmark(b'{"results": [1, 2, 3]}', number=2)
+    assert 'json' in timings
+    assert (decoders.orjson is not None) == ('orjson' in timings)
+    assert all(duration >= 0 for duration in timings.values())
@@ -7,11 +7,15 @@ from datetime import datetime
 from udata.app import create_app
 from udata.core.organization.factories import OrganizationFactory
 from udata.harvest import actions
+from udata.harvest.models import HarvestJob
 from udata.harvest.tests.factories import HarvestSourceFactory
 from udata.models import Dataset
 from udata.settings import Defaults, Testing
 from udata.tests.plugin import drop_db
 
+from udata_ckan.harvesters import DkanBackend
+from udata_ckan.tasks import harvest_delta
+
 
 def data_path(filename):
     '''Get a test data path'''
@@ -37,21 +41,22 @@ def test_dkan_french_w_license(app, rmock):
     '''CKAN Harvester should accept the minimum dataset payload'''
     DKAN_URL = 'https://harvest.me/'
     API_URL = '{}api/3/action/'.format(DKAN_URL)
-    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
-    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+    BULK_URL = '{}current_package_list_with_resources'.format(API_URL)
 
     with open(data_path('dkan-french-w-license.json')) as ifile:
         data = json.loads(ifile.read())
 
     org = OrganizationFactory()
     source = HarvestSourceFactory(backend='dkan', url=DKAN_URL, organization=org)
-    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': ['fake-name']}, status_code=200,
-              headers={'Content-Type': 'application/json'})
-    rmock.get(PACKAGE_SHOW_URL, json=data, status_code=200,
-              headers={'Content-Type': 'application/json'})
+    rmock.get(BULK_URL, [
+        {'json': data, 'status_code': 200, 'headers': {'Content-Type': 'application/json'}},
+        {'json': {'success': True, 'result': []}, 'status_code': 200,
+         'headers': {'Content-Type': 'application/json'}},
+    ])
     actions.run(source.slug)
     source.reload()
     assert source.get_last_job().status == 'done'
+    assert [r.qs.get('offset') for r in rmock.request_history] == [['0'], ['1']]
 
     datasets = Dataset.objects.filter(organization=org)
     assert len(datasets) > 0
@@ -61,3 +66,72 @@ def test_dkan_french_w_license(app, rmock):
     assert dataset.harvest.modified_at == datetime(2019, 9, 30, 0, 0)
     assert len(dataset.resources) == 2
     assert 'xlsx' in [r.format for r in dataset.resources]
+
+
+def test_dkan_fallback_on_package_list(app, rmock):
+    '''DKAN Harvester should list and show packages when bulk listing is not available'''
+    DKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(DKAN_URL)
+    BULK_URL = '{}current_package_list_with_resources'.format(API_URL)
+    PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+    PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+    with open(data_path('dkan-french-w-license.json')) as ifile:
+        data = json.loads(ifile.read())
+
+    # Features not provided by DKAN are ignored
+    source = HarvestSourceFactory(backend='dkan', url=DKAN_URL, config={
+        'features': {'activity_sync': True, 'probe': True},
+    })
+    rmock.get(BULK_URL, text='Not found', status_code=404,
+              headers={'Content-Type': 'text/html'})
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': ['fake-name']}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_SHOW_URL, json=data, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    actions.run(source.slug)
+    source.reload()
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert job.items[0].remote_id == '04be6288-696d-4331-850d-a144871a7e3a'
+    assert [r.path for r in rmock.request_history if 'activity' in r.path] == []
+
+
+def test_dkan_has_no_delta_harvest(app, rmock):
+    '''DKAN sources should not be delta harvested: DKAN has no activities'''
+    source = HarvestSourceFactory(backend='dkan', url='https://harvest.me/')
+    HarvestJob.objects.create(source=source, status='done',
+                              data={'activity_checkpoint': '2024-01-01T00:00:00'})
+
+    assert 'activity_sync' not in [f.key for f in DkanBackend.features]
+    harvest_delta(str(source.id))
+    assert DkanBackend(source).harvest_delta(60) is None
+
+    assert not rmock.called
+    assert HarvestJob.objects(source=source).count() == 1
+
+
+def test_dkan_groups_are_validated_once(app, rmock):
+    '''DKAN Harvester should only validate a group on its first occurrence'''
+    DKAN_URL = 'https://harvest.me/'
+    API_URL = '{}api/3/action/'.format(DKAN_URL)
+    BULK_URL = '{}current_package_list_with_resources'.format(API_URL)
+
+    with open(data_path('dkan-french-w-license.json')) as ifile:
+        package = json.loads(ifile.read())['result'][0]
+    packages = [dict(package, id='{0}-{1}'.format(package['id'], i)) for i in range(2)]
+
+    source = HarvestSourceFactory(backend='dkan', url=DKAN_URL)
+    rmock.get(BULK_URL, [
+        {'json': {'success': True, 'result': packages}, 'status_code': 200,
+         'headers': {'Content-Type': 'application/json'}},
+        {'json': {'success': True, 'result': []}, 'status_code': 200,
+         'headers': {'Content-Type': 'application/json'}},
+    ])
+    actions.run(source.slug)
+    source.reload()
+
+    job = source.get_last_job()
+    assert job.status == 'done'
+    assert len(job.items) == 2
+    assert job.data['references'] == {'cached': 1}
@@ -0,0 +1,84 @@
+import gzip
+import json
+
+import pytest
+
+from udata_ckan.dumps import compression, iter_packages, iter_stream_lines, write_packages
+
+PACKAGES = [{'id': str(i), 'name': 'dataset-{0}'.format(i)} for i in range(3)]
+
+
+def dump(packages):
+    return b''.join(json.dumps(p).encode() + b'\n' for p in packages)
+
+
+def test_plain_dump(tmp_path):
+    path = tmp_path / 'dump.jsonl'
+    path.write_bytes(dump(PACKAGES))
+
+    assert compression(path) is None
+    assert list(iter_packages(path)) == PACKAGES
+
+
+def test_gzip_dump(tmp_path):
+    path = tmp_path / 'dump.jsonl.gz'
+    path.write_bytes(gzip.compress(dump(PACKAGES)))
+
+    assert compression(path) == 'gzip'
+    assert list(iter_packages(path)) == PACKAGES
+
+
+def test_zstd_dump(tmp_path):
+    zstandard = pytest.importorskip('zstandard')
+    path = tmp_path / 'dump.jsonl.zst'
+    path.write_bytes(zstandard.ZstdCompressor().compress(dump(PACKAGES)))
+
+    assert compression(path) == 'zstd'
+    assert list(iter_packages(path)) == PACKAGES
+
+
+def test_empty_dump(tmp_path):
+    path = tmp_path / 'dump.jsonl'
+    path.write_bytes(b'')
+
+    assert list(iter_packages(path)) == []
+
+
+def test_invalid_lines_are_ignored(tmp_path):
+    path = tmp_path / 'dump.jsonl'
+    path.write_bytes(b'\n'.join([json.dumps(PACKAGES[0]).encode(), b'', b'{invalid',
+                                 json.dumps(PACKAGES[1]).encode()]))
+
+    assert list(iter_packages(path)) == PACKAGES[:2]
+
+
+class Reader(object):
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, size):
+        chunk, self.data = self.data[:size], self.data[size:]
+        return chunk
+
+
+def test_iter_stream_lines():
+    lines = iter_stream_lines(Reader(b'first\nsecond\nthird'), chunk_size=4)
+
+    assert list(lines) == [b'first', b'second', b'third']
+
+
+@pytest.mark.parametrize('filename,kind', [
+    ('dump.jsonl', None),
+    ('dump.jsonl.gz', 'gzip'),
+    ('dump.jsonl.zst', 'zstd'),
+])
+def test_write_packages(tmp_path, filename, kind):
+    if kind == 'zstd':
+        pytest.importorskip('zstandard')
+    path = tmp_path / filename
+    with write_packages(path) as write:
+        for package in PACKAGES:
+            write(package)
+
+    assert compression(path) == kind
+    assert list(iter_packages(path)) == PACKAGES
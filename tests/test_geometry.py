@@ -0,0 +1,77 @@
+import pytest
+
+from udata_ckan.geometry import (
+    GeometryPipeline, InvalidGeometry, count_vertices, simplify, simplify_ring, validate
+)
+
+
+def square(size=1, steps=10):
+    '''A closed square ring with `steps` aligned positions on each side'''
+    side = [i * size / steps for i in range(steps)]
+    ring = ([[x, 0] for x in side] + [[size, y] for y in side]
+            + [[size - x, size] for x in side] + [[0, size - y] for y in side])
+    return ring + [ring[0]]
+
+
+def test_validate_accepts_closed_rings():
+    validate([[square()]])
+
+
+@pytest.mark.parametrize('coordinates', [
+    [],
+    [[]],
+    [[[[0, 0], [1, 0], [0, 0]]]],
+    [[[[0, 0], [1, 0], [1, 1], [0, 1]]]],
+    [[[[0, 0], [200, 0], [1, 1], [0, 0]]]],
+    [[[[0, 0], ['a', 0], [1, 1], [0, 0]]]],
+])
+def test_validate_rejects_invalid_geometries(coordinates):
+    with pytest.raises(InvalidGeometry):
+        validate(coordinates)
+
+
+def test_simplify_ring_removes_aligned_positions():
+    ring = square()
+
+    simplified = simplify_ring(ring, 0.0001)
+
+    assert simplified == [[0, 0], [1, 0], [1, 1], [0, 1], [0, 0]]
+
+
+def test_simplify_ring_keeps_small_rings():
+    ring = [[0, 0], [1, 0], [1, 1], [0, 0]]
+
+    assert simplify_ring(ring, 10) == ring
+
+
+def test_simplify_fits_vertices_budget():
+    # A jagged ring, not simplifiable with the initial tolerance
+    ring = [[i / 100, (i % 2) / 1000] for i in range(100)] + [[1, 1], [0, 1], [0, 0]]
+    ring[0] = [0, 0]
+
+    simplified = simplify([[ring]], 0.0001, max_vertices=10)
+
+    assert count_vertices(simplified) <= 10
+
+
+def test_pipeline_deduplicates_and_counts_bytes():
+    pipeline = GeometryPipeline()
+    geom = {'type': 'MultiPolygon', 'coordinates': [[square()]]}
+
+    first = pipeline.process(geom)
+    second = pipeline.process(geom)
+
+    assert first is second
+    assert count_vertices(first['coordinates']) == 5
+    assert pipeline.metrics['geometries'] == 2
+    assert pipeline.metrics['deduplicated'] == 1
+    assert pipeline.metrics['simplified'] == 1
+    assert pipeline.metrics['bytes_out'] < pipeline.metrics['bytes_in']
+
+
+def test_pipeline_drops_invalid_geometries():
+    pipeline = GeometryPipeline()
+    geom = {'type': 'MultiPolygon', 'coordinates': [[[[0, 0], [1, 0], [1, 1]]]]}
+
+    assert pipeline.process(geom) is None
+    assert pipeline.metrics['invalid'] == 1
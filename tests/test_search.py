@@ -0,0 +1,68 @@
+import pytest
+
+from udata.harvest.exceptions import HarvestException
+
+from udata_ckan.search import build_query, quote
+
+
+@pytest.mark.parametrize('value,expected', [
+    ('simple-value', 'simple-value'),
+    ('with space', '"with space"'),
+    ('with:colon', '"with:colon"'),
+    ('with "quotes"', '"with \\"quotes\\""'),
+    ('back\\slash', '"back\\\\slash"'),
+    ('', '""'),
+    ('-prefixed', '"-prefixed"'),
+])
+def test_quote(value, expected):
+    assert quote(value) == expected
+
+
+def test_build_query_without_filters():
+    assert build_query([]) is None
+
+
+def test_build_query():
+    query = build_query([
+        {'key': 'organization', 'value': 'org'},
+        {'key': 'tags', 'value': 'a', 'type': 'exclude'},
+        {'key': 'tags', 'value': 'b c', 'type': 'exclude'},
+        {'key': 'res_format', 'value': 'CSV'},
+        {'key': 'res_format', 'value': 'JSON'},
+        {'key': 'modified_since', 'value': '2024-01-31T12:30:00'},
+    ])
+
+    assert query == ' '.join([
+        '+organization:org',
+        '-tags:a',
+        '-tags:"b c"',
+        '+res_format:CSV',
+        '+res_format:JSON',
+        '+metadata_modified:[2024-01-31T12:30:00Z TO *]',
+    ])
+
+
+def test_build_query_any():
+    query = build_query([
+        {'key': 'organization', 'value': 'org-1', 'type': 'any'},
+        {'key': 'tags', 'value': 'a'},
+        {'key': 'organization', 'value': 'org 2', 'type': 'any'},
+        {'key': 'groups', 'value': 'a', 'type': 'any'},
+    ])
+
+    assert query == '+organization:(org-1 OR "org 2") +tags:a +groups:a'
+
+
+def test_build_query_single_include_is_required():
+    # CKAN <= 2.8 appends ` +site_id:... +state:active` to `fq`
+    assert build_query([{'key': 'organization', 'value': 'org'}]) == '+organization:org'
+
+
+def test_build_query_date_with_timezone():
+    query = build_query([{'key': 'modified_since', 'value': '2024-01-31T12:30:00+02:00'}])
+    assert query == '+metadata_modified:[2024-01-31T10:30:00Z TO *]'
+
+
+def test_build_query_invalid_date():
+    with pytest.raises(HarvestException):
+        build_query([{'key': 'modified_since', 'value': 'not a date'}])
@@ -0,0 +1,86 @@
+import pytest
+
+from udata.harvest import actions
+from udata.harvest.exceptions import HarvestException
+from udata.harvest.tests.factories import HarvestSourceFactory
+
+from udata_ckan.harvesters import CkanBackend
+from udata_ckan.transports import FakeTransport, get_transport, request_key
+
+
+pytestmark = [
+    pytest.mark.usefixtures('clean_db'),
+    pytest.mark.options(PLUGINS=['ckan']),
+]
+
+CKAN_URL = 'https://harvest.me/'
+API_URL = '{}api/3/action/'.format(CKAN_URL)
+PACKAGE_LIST_URL = '{}package_list'.format(API_URL)
+PACKAGE_SHOW_URL = '{}package_show'.format(API_URL)
+
+
+def test_request_key_ignores_params_order():
+    assert request_key('GET', 'http://a/b', {'y': 1, 'x': 'c d'}) == 'GET http://a/b?x=c+d&y=1'
+    assert request_key('GET', 'http://a/b', {}) == 'GET http://a/b'
+
+
+def test_unknown_transport():
+    with pytest.raises(HarvestException):
+        get_transport('unknown')
+
+
+@pytest.mark.parametrize('name', ['requests', 'session'])
+def test_requests_transports(app, rmock, name):
+    app.config['CKAN_TRANSPORT'] = name
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': []}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+
+    actions.run(source.slug)
+
+    assert source.get_last_job().status == 'done'
+    assert rmock.last_request.headers['User-Agent'].startswith('uData')
+
+
+def test_record_and_replay(app, rmock, tmp_path):
+    path = str(tmp_path / 'cassette.jsonl')
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    rmock.get(PACKAGE_LIST_URL, json={'success': True, 'result': ['a']}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    rmock.get(PACKAGE_SHOW_URL, json={'success': False, 'error': 'Not found'}, status_code=200,
+              headers={'Content-Type': 'application/json'})
+    app.config.update(CKAN_TRANSPORT='record', CKAN_TRANSPORT_OPTIONS={'path': path})
+    actions.run(source.slug)
+    recorded = source.get_last_job()
+
+    rmock.reset_mock()
+    app.config.update(CKAN_TRANSPORT='replay')
+    actions.run(source.slug)
+    replayed = source.get_last_job()
+
+    assert not rmock.called
+    assert [(i.remote_id, i.status) for i in replayed.items] == \
+        [(i.remote_id, i.status) for i in recorded.items] == [('a', 'failed')]
+    assert replayed.items[0].errors[0].message == 'Not found'
+
+
+def test_fake_transport(app):
+    source = HarvestSourceFactory(backend='ckan', url=CKAN_URL)
+    fake = FakeTransport()
+    fake.add(PACKAGE_LIST_URL, {'success': True, 'result': ['a']}, params={'limit': 1000})
+    fake.add(PACKAGE_LIST_URL, {'success': True, 'result': []},
+             params={'limit': 1000, 'offset': 1})
+    backend = CkanBackend(source)
+    backend.transport = fake
+
+    job = backend.harvest()
+
+    assert fake.requests == [
+        'GET {0}?limit=1000'.format(PACKAGE_LIST_URL),
+        'GET {0}?id=a'.format(PACKAGE_SHOW_URL),
+        'GET {0}?limit=1000&offset=1'.format(PACKAGE_LIST_URL),
+    ]
+    # Unknown requests are 404
+    assert job.items[0].status == 'failed'
+    assert 'parsing' in job.data['transfer']['package_list']
+    assert job.data['json_decoder'] in ('json', 'orjson')
@@ -0,0 +1,55 @@
+from udata.api import API, api, fields
+from udata.harvest import actions
+from udata.harvest.models import HarvestJob
+
+from .harvesters import LATENCY_BUCKETS
+
+ns = api.namespace('ckan', 'CKAN harvest related operations')
+
+# Job data sections exposed as metrics
+METRICS = ('transfer', 'latency', 'throughput')
+# Maximum number of jobs metrics fetched at once
+MAX_LIMIT = 100
+
+metrics_fields = api.model('CkanHarvestMetrics', {
+    'id': fields.String(description='The job unique identifier', readonly=True),
+    'created': fields.ISODateTime(description='The job creation date', readonly=True),
+    'status': fields.String(description='The job status', readonly=True),
+    'transfer': fields.Raw(
+        attribute=lambda job: job.data.get('transfer'),
+        description='Requests, errors, time (s), wire and decoded bytes per action',
+        readonly=True),
+    'latency': fields.Raw(
+        attribute=lambda job: job.data.get('latency'),
+        description='Requests latency histogram per action (see `latency_buckets`)',
+        readonly=True),
+    'latency_buckets': fields.Raw(
+        attribute=lambda job: LATENCY_BUCKETS,
+        description='The latency buckets upper bounds in seconds, the last one being unbounded',
+        readonly=True),
+    'throughput': fields.Raw(
+        attribute=lambda job: job.data.get('throughput'),
+        description='Processed items, duration (s) and items per second',
+        readonly=True),
+})
+
+parser = api.parser()
+parser.add_argument('limit', type=int, default=10, location='args',
+                    help='The number of last jobs to fetch (100 max)')
+
+
+@ns.route('/source/<string:ident>/metrics/', endpoint='ckan_source_metrics')
+@api.param('ident', 'A source ID or slug')
+class SourceMetricsAPI(API):
+    @api.doc('ckan_source_metrics')
+    @api.expect(parser)
+    @api.marshal_list_with(metrics_fields)
+    def get(self, ident):
+        '''Connection, latency and throughput metrics of the last jobs of a source'''
+        args = parser.parse_args()
+        # A zero limit would mean no limit
+        limit = max(1, min(args['limit'], MAX_LIMIT))
+        source = actions.get_source(ident)
+        only = ['id', 'created', 'status'] + ['data__{0}'.format(key) for key in METRICS]
+        return list(HarvestJob.objects(source=source).only(*only)
+                    .order_by('-created').limit(limit))
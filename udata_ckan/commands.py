@@ -0,0 +1,131 @@
+import logging
+
+import click
+
+from flask import current_app
+
+from udata.commands import cli
+from udata.harvest import actions, backends
+
+from .decoders import benchmark
+from .dumps import write_packages
+from .harvesters import CkanBackend
+from .profiling import HarvestProfiler
+
+log = logging.getLogger(__name__)
+
+
+@cli.group('ckan')
+def grp():
+    '''CKAN harvesting operations'''
+    pass
+
+
+def get_backend(identifier, **kwargs):
+    '''Get the CKAN backend for a given source identifier'''
+    source = actions.get_source(identifier)
+    cls = backends.get(current_app, source.backend)
+    if not issubclass(cls, CkanBackend):
+        raise click.BadParameter('Source {0} is not a CKAN source'.format(identifier))
+    return cls(source, **kwargs)
+
+
+@grp.command()
+@click.argument('identifier')
+@click.option('-o', '--output', default='.', type=click.Path(file_okay=False),
+              help='The directory where profile artifacts are written')
+@click.option('--memory/--no-memory', default=True,
+              help='Trace memory allocations (slower)')
+@click.option('-d', '--dryrun', is_flag=True, help='Do not persist anything')
+def profile(identifier, output, memory, dryrun):
+    '''Run a harvester synchronously with CPU and memory profiling'''
+    log.info('Profiling harvest of source "%s"', identifier)
+    backend = get_backend(identifier, dryrun=dryrun)
+    backend.profiler = HarvestProfiler(output, memory=memory)
+    job = backend.harvest()
+    for key in 'cpu', 'memory', 'report':
+        if key in job.data['profile']:
+            log.info('%s profile: %s', key, job.data['profile'][key])
+
+
+@grp.command()
+@click.argument('identifier')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('-d', '--dryrun', is_flag=True, help='Do not persist anything')
+def replay(identifier, path, dryrun):
+    '''
+    Harvest a source from a dump file instead of its API
+
+    The dump is a JSON lines file with a package per line (ckanapi dump format),
+    optionally gzip or Zstandard compressed.
+    '''
+    log.info('Replaying dump %s for source "%s"', path, identifier)
+    backend = get_backend(identifier, dryrun=dryrun)
+    backend.dump = path
+    job = backend.harvest()
+    log.info('Replayed %s packages with status %s', len(job.items), job.status)
+
+
+@grp.command()
+@click.argument('identifier')
+@click.argument('path', type=click.Path(dir_okay=False))
+@click.option('-d', '--dryrun', is_flag=True, help='Do not persist anything')
+def snapshot(identifier, path, dryrun):
+    '''
+    Harvest a source, writing its valid packages into a dump file
+
+    The dump can be replayed with `udata ckan replay`.
+    It is gzip or Zstandard compressed given its `.gz` or `.zst` extension.
+    '''
+    log.info('Snapshotting source "%s" into %s', identifier, path)
+    backend = get_backend(identifier, dryrun=dryrun)
+    with write_packages(path) as write:
+        backend.snapshot = write
+        job = backend.harvest()
+    log.info('Harvested %s packages with status %s', len(job.items), job.status)
+
+
+@grp.command()
+@click.argument('identifier')
+@click.argument('index', type=click.IntRange(min=0))
+@click.argument('count', type=click.IntRange(min=1))
+@click.option('-d', '--dryrun', is_flag=True, help='Do not persist anything')
+def shard(identifier, index, count, dryrun):
+    '''
+    Harvest the INDEX shard (starting at 0) of a source split into COUNT shards
+
+    Packages are assigned to shards given a stable hash of their id, so running
+    every shard, in parallel or not, harvests each package once
+    (unless packages are created or deleted meanwhile, shifting the listing pages).
+    Sharded runs neither archive datasets not on the remote anymore
+    nor use or record activity checkpoints.
+    '''
+    if index >= count:
+        raise click.BadParameter('Shard index must be lower than {0}'.format(count))
+    log.info('Harvesting shard %s/%s of source "%s"', index, count, identifier)
+    backend = get_backend(identifier, dryrun=dryrun)
+    backend.shard = (index, count)
+    job = backend.harvest()
+    log.info('Harvested %s packages with status %s', len(job.items), job.status)
+
+
+@grp.command('bench-json')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('-n', '--number', default=10, type=click.IntRange(min=1),
+              help='Number of decodings per decoder')
+def bench_json(path, number):
+    '''
+    Compare the JSON decoders on an API response file
+
+    ie. a package_search page saved with
+    `curl -o page.json "https://<ckan>/api/3/action/package_search?rows=1000"`.
+    '''
+    with open(path, 'rb') as f:
+        content = f.read()
+    timings = benchmark(content, number)
+    for name, duration in timings.items():
+        log.info('%s: %.3fs per decoding', name, duration / number)
+    if 'orjson' in timings:
+        log.info('orjson is %.1f times faster', timings['json'] / timings['orjson'])
+    else:
+        log.info('orjson is not installed: pip install udata-ckan[orjson]')
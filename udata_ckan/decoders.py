@@ -0,0 +1,45 @@
+'''
+JSON decoding of API responses and dumps, with orjson when installed
+
+orjson decodes straight from the raw bytes, without decoding them into a `str` first,
+and is faster than the standard library on large `package_search` pages.
+Compare both on a given response with `udata ckan bench-json`.
+'''
+import json
+import time
+
+try:
+    import orjson
+except ImportError:  # Optional dependency: pip install udata-ckan[orjson]
+    orjson = None
+
+DECODER = 'orjson' if orjson is not None else 'json'
+
+
+def loads(content):
+    '''
+    Decode a JSON document given as bytes or `str`.
+
+    Documents orjson rejects while the standard library accepts them
+    (ie. `NaN` values or non UTF-8 encodings) are decoded by the latter.
+    '''
+    if orjson is not None:
+        try:
+            return orjson.loads(content)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(content)
+
+
+def benchmark(content, number=10):
+    '''Time the decoding of `content` `number` times with each available decoder, in seconds'''
+    decoders = {'json': json.loads}
+    if orjson is not None:
+        decoders['orjson'] = orjson.loads
+    timings = {}
+    for name, decode in decoders.items():
+        start = time.perf_counter()
+        for _ in range(number):
+            decode(content)
+        timings[name] = time.perf_counter() - start
+    return timings
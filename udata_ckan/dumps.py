@@ -0,0 +1,125 @@
+'''
+CKAN JSON lines dumps (`ckanapi dump datasets` format): one package per line,
+optionally gzip or Zstandard compressed.
+
+Dumps are replayed by `udata ckan replay` and written by `udata ckan snapshot`.
+'''
+import gzip
+import json
+import logging
+import mmap
+
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency: pip install udata-ckan[zstd]
+    zstandard = None
+
+from udata.harvest.exceptions import HarvestException
+
+from .decoders import loads
+
+log = logging.getLogger(__name__)
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def compression(path):
+    '''Detect a dump compression (`gzip`, `zstd` or `None`) from its magic number'''
+    with open(path, 'rb') as f:
+        magic = f.read(4)
+    if magic.startswith(GZIP_MAGIC):
+        return 'gzip'
+    if magic == ZSTD_MAGIC:
+        return 'zstd'
+
+
+@contextmanager
+def open_lines(path):
+    '''
+    Open a dump as an iterator of lines.
+
+    Uncompressed dumps are memory-mapped so lines are read at disk speed
+    without going through Python buffered IO.
+    '''
+    kind = compression(path)
+    if kind == 'gzip':
+        with gzip.open(path, 'rb') as f:
+            yield f
+    elif kind == 'zstd':
+        if zstandard is None:
+            raise HarvestException('Reading Zstandard dumps requires the zstandard package')
+        with open(path, 'rb') as raw:
+            with zstandard.ZstdDecompressor().stream_reader(raw) as reader:
+                yield iter_stream_lines(reader)
+    else:
+        with open(path, 'rb') as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files can't be mapped
+                yield iter([])
+                return
+            with mapped:
+                yield iter(mapped.readline, b'')
+
+
+def iter_stream_lines(reader, chunk_size=1 << 20):
+    '''Split a binary stream without `readline` support into lines'''
+    pending = b''
+    while True:
+        chunk = reader.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + chunk).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+def iter_packages(path):
+    '''Yield the packages of a dump, one at a time'''
+    with open_lines(path) as lines:
+        for number, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield loads(line)
+            except ValueError as e:
+                log.error('Ignoring invalid JSON on line %s of %s: %s', number, path, e)
+
+
+def compression_for(path):
+    '''The compression matching a dump file extension'''
+    if str(path).endswith('.gz'):
+        return 'gzip'
+    if str(path).endswith(('.zst', '.zstd')):
+        return 'zstd'
+
+
+@contextmanager
+def write_packages(path):
+    '''
+    Open a dump for writing as a function writing a package,
+    gzip or Zstandard compressed given the file extension (`.gz` or `.zst`).
+    '''
+    kind = compression_for(path)
+    if kind == 'zstd' and zstandard is None:
+        raise HarvestException('Writing Zstandard dumps requires the zstandard package')
+    if kind == 'gzip':
+        out = gzip.open(path, 'wb')
+    elif kind == 'zstd':
+        out = zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd=True)
+    else:
+        out = open(path, 'wb')
+
+    def write(package):
+        out.write(json.dumps(package, separators=(',', ':')).encode('utf-8'))
+        out.write(b'\n')
+
+    with out:
+        yield write
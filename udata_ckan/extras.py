@@ -0,0 +1,99 @@
+'''
+CKAN extras handlers
+
+Handlers are registered on extra keys with `extra_handler`
+and called with the backend, the harvested dataset, the extra key and value,
+and a `state` dict shared by all the extras of a dataset
+to collect values needing more than a single extra (spatial and temporal coverages).
+Extras without handler are stored as is in the dataset extras.
+'''
+import json
+import logging
+
+from functools import lru_cache
+
+try:
+    from udata.core.dataset.constants import UPDATE_FREQUENCIES
+except ImportError:
+    # legacy import of constants in udata
+    from udata.models import UPDATE_FREQUENCIES
+from udata.core.dataset.rdf import frequency_from_rdf
+from udata.models import db, GeoZone
+from udata.utils import daterange_start, daterange_end
+
+log = logging.getLogger(__name__)
+
+EXTRAS_HANDLERS = {}
+
+
+def extra_handler(*keys):
+    '''Register a handler for the given extras keys'''
+    def wrapper(func):
+        for key in keys:
+            EXTRAS_HANDLERS[key] = func
+        return func
+    return wrapper
+
+
+@lru_cache(maxsize=256)
+def map_frequency(value):
+    '''
+    Map a CKAN frequency to an udata frequency.
+
+    Portals reuse a handful of values so the RDF parsing is memoized.
+    '''
+    return frequency_from_rdf(value) or (value if value in UPDATE_FREQUENCIES else None)
+
+
+def store_extra(backend, dataset, key, value, state):
+    '''Default handler: keep the extra as is'''
+    dataset.extras[key] = value
+
+
+@extra_handler('spatial')
+def spatial(backend, dataset, key, value, state):
+    # GeoJSON representation (Polygon or Point)
+    state['spatial_geom'] = json.loads(value)
+    state['spatial_raw'] = value
+
+
+@extra_handler('spatial-text')
+def spatial_text(backend, dataset, key, value, state):
+    # Textual representation of the extent / location
+    # (not resolved on dry runs to avoid any database lookup)
+    qs = None if backend.dryrun else GeoZone.objects(db.Q(name=value) | db.Q(slug=value))
+    if qs is not None and qs.count() == 1:
+        state['spatial_zone'] = qs.first()
+    else:
+        dataset.extras['ckan:spatial-text'] = value
+        log.debug('spatial-text value not handled: %s', value)
+
+
+@extra_handler('spatial-uri')
+def spatial_uri(backend, dataset, key, value, state):
+    # Linked Data URI representing the place name
+    dataset.extras['ckan:spatial-uri'] = value
+    log.debug('spatial-uri value not handled: %s', value)
+
+
+@extra_handler('frequency')
+def frequency(backend, dataset, key, value, state):
+    # Update frequency
+    freq = map_frequency(value) if isinstance(value, str) else None
+    if freq:
+        dataset.frequency = freq
+    else:
+        dataset.extras['ckan:frequency'] = value
+        log.debug('frequency value not handled: %s', value)
+
+
+@extra_handler('temporal_start')
+def temporal_start(backend, dataset, key, value, state):
+    # Temporal coverage start
+    state['temporal_start'] = daterange_start(value)
+
+
+@extra_handler('temporal_end')
+def temporal_end(backend, dataset, key, value, state):
+    # Temporal coverage end
+    state['temporal_end'] = daterange_end(value)
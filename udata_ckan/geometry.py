@@ -0,0 +1,156 @@
+'''
+Spatial geometries validation, deduplication and simplification
+'''
+import hashlib
+import json
+import logging
+
+from collections import OrderedDict
+
+log = logging.getLogger(__name__)
+
+# Default simplification tolerance in degrees (~10m at the equator)
+DEFAULT_TOLERANCE = 0.0001
+# Default maximum number of vertices of a processed geometry
+DEFAULT_MAX_VERTICES = 1000
+# Tolerance above which we stop trying to fit the vertices budget
+MAX_TOLERANCE = 1.0
+# Number of processed geometries kept to deduplicate identical ones
+CACHE_SIZE = 1024
+
+
+class InvalidGeometry(ValueError):
+    pass
+
+
+def validate(coordinates):
+    '''Ensure MultiPolygon coordinates are made of closed WGS84 rings'''
+    if not isinstance(coordinates, list) or not coordinates:
+        raise InvalidGeometry('Empty geometry')
+    for polygon in coordinates:
+        if not isinstance(polygon, list) or not polygon:
+            raise InvalidGeometry('Empty polygon')
+        for ring in polygon:
+            if not isinstance(ring, list) or len(ring) < 4:
+                raise InvalidGeometry('Rings must have at least 4 positions')
+            for position in ring:
+                if not isinstance(position, (list, tuple)) or len(position) < 2:
+                    raise InvalidGeometry('Invalid position {0}'.format(position))
+                lon, lat = position[0], position[1]
+                if not all(isinstance(c, (int, float)) and not isinstance(c, bool)
+                           for c in (lon, lat)):
+                    raise InvalidGeometry('Invalid position {0}'.format(position))
+                if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+                    raise InvalidGeometry('Position out of bounds {0}'.format(position))
+            if list(ring[0][:2]) != list(ring[-1][:2]):
+                raise InvalidGeometry('Unclosed ring')
+
+
+def count_vertices(coordinates):
+    return sum(len(ring) for polygon in coordinates for ring in polygon)
+
+
+def distance(point, start, end):
+    '''Distance from `point` to the [`start`, `end`] segment'''
+    (x, y), (x1, y1), (x2, y2) = point[:2], start[:2], end[:2]
+    dx, dy = x2 - x1, y2 - y1
+    if dx or dy:
+        t = max(0, min(1, ((x - x1) * dx + (y - y1) * dy) / (dx * dx + dy * dy)))
+        x1, y1 = x1 + t * dx, y1 + t * dy
+    return ((x - x1) ** 2 + (y - y1) ** 2) ** .5
+
+
+def simplify_ring(ring, tolerance):
+    '''
+    Simplify a closed ring with the Ramer-Douglas-Peucker algorithm.
+
+    The ring is returned untouched if simplifying would make it degenerated.
+    '''
+    if len(ring) <= 4 or not tolerance:
+        return ring
+    keep = [False] * len(ring)
+    keep[0] = keep[-1] = True
+    stack = [(0, len(ring) - 1)]
+    while stack:
+        first, last = stack.pop()
+        farthest, max_distance = None, tolerance
+        for index in range(first + 1, last):
+            d = distance(ring[index], ring[first], ring[last])
+            if d > max_distance:
+                farthest, max_distance = index, d
+        if farthest is not None:
+            keep[farthest] = True
+            stack.append((first, farthest))
+            stack.append((farthest, last))
+    simplified = [position for position, kept in zip(ring, keep) if kept]
+    return simplified if len(simplified) >= 4 else ring
+
+
+def simplify(coordinates, tolerance, max_vertices=None):
+    '''
+    Simplify MultiPolygon coordinates with the given tolerance,
+    raising it until the result fits in `max_vertices` if given.
+    '''
+    while True:
+        simplified = [[simplify_ring(ring, tolerance) for ring in polygon]
+                      for polygon in coordinates]
+        if not max_vertices or count_vertices(simplified) <= max_vertices:
+            return simplified
+        if tolerance >= MAX_TOLERANCE:
+            log.debug('Unable to fit geometry in %s vertices', max_vertices)
+            return simplified
+        tolerance = tolerance * 2 if tolerance else DEFAULT_TOLERANCE
+
+
+class GeometryPipeline(object):
+    '''
+    Validate and simplify MultiPolygon geometries,
+    processing identical geometries of a source only once.
+
+    `metrics` counts processed, deduplicated, simplified and invalid geometries
+    and the GeoJSON bytes before and after processing.
+    '''
+    def __init__(self, tolerance=DEFAULT_TOLERANCE, max_vertices=DEFAULT_MAX_VERTICES):
+        self.tolerance = tolerance
+        self.max_vertices = max_vertices
+        self.cache = OrderedDict()
+        self.metrics = dict.fromkeys(('geometries', 'deduplicated', 'simplified', 'invalid',
+                                      'bytes_in', 'bytes_out'), 0)
+
+    def process(self, geom, raw=None):
+        '''
+        Process a MultiPolygon geometry given its raw GeoJSON representation if known.
+
+        Return `None` for invalid geometries.
+        '''
+        raw = raw if isinstance(raw, str) else json.dumps(geom)
+        key = hashlib.sha1(raw.encode('utf-8')).digest()
+        self.metrics['geometries'] += 1
+        self.metrics['bytes_in'] += len(raw)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.metrics['deduplicated'] += 1
+            result, size = self.cache[key]
+            self.metrics['bytes_out'] += size
+            return result
+
+        try:
+            validate(geom['coordinates'])
+        except InvalidGeometry as e:
+            log.warning('Ignoring invalid spatial geometry: %s', e)
+            self.metrics['invalid'] += 1
+            result, size = None, 0
+        else:
+            coordinates = simplify(geom['coordinates'], self.tolerance, self.max_vertices)
+            if count_vertices(coordinates) < count_vertices(geom['coordinates']):
+                self.metrics['simplified'] += 1
+                result = {'type': geom['type'], 'coordinates': coordinates}
+                size = len(json.dumps(result))
+            else:
+                result, size = geom, len(raw)
+
+        self.metrics['bytes_out'] += size
+        self.cache[key] = (result, size)
+        if len(self.cache) > CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return result
@@ -1,36 +1,136 @@
+import hashlib
 import json
 import logging
+import re
+import time
+import uuid
 
+from bisect import bisect_left
+from datetime import datetime
+from functools import cached_property
+from itertools import chain
 from uuid import UUID
 from urllib.parse import urljoin
 
+from flask import current_app
+from requests.exceptions import HTTPError, RequestException
+from urllib3.util.request import ACCEPT_ENCODING
+from voluptuous import MultipleInvalid
+
 from udata import uris
+from udata.app import cache
 from udata.i18n import lazy_gettext as _
-from udata.harvest.models import HarvestItem
-try:
-    from udata.core.dataset.constants import UPDATE_FREQUENCIES
-except ImportError:
-    # legacy import of constants in udata
-    from udata.models import UPDATE_FREQUENCIES
+from udata.harvest.models import (
+    HarvestError, HarvestItem, HarvestJob, archive_harvested_dataset
+)
 from udata.core.dataset.models import HarvestDatasetMetadata, HarvestResourceMetadata
-from udata.core.dataset.rdf import frequency_from_rdf
 from udata.frontend.markdown import parse_html
 from udata.models import (
-    db, Resource, License, SpatialCoverage, GeoZone
+    db, Dataset, Resource, License, SpatialCoverage
 )
-from udata.utils import get_by, daterange_start, daterange_end
 
-from udata.harvest.backends.base import BaseBackend, HarvestFilter
-from udata.harvest.exceptions import HarvestException, HarvestSkipException
+from udata.harvest.backends.base import (
+    BaseBackend, HarvestExtraConfig, HarvestFeature, HarvestFilter
+)
+from udata.harvest.exceptions import (
+    HarvestException, HarvestSkipException, HarvestValidationError
+)
 
-from .schemas.ckan import schema as ckan_schema
-from .schemas.dkan import schema as dkan_schema
+from .decoders import DECODER, loads
+from .dumps import iter_packages
+from .extras import EXTRAS_HANDLERS, store_extra
+from .geometry import GeometryPipeline, DEFAULT_MAX_VERTICES, DEFAULT_TOLERANCE
+from .search import build_query
+from .transports import DEFAULT_TRANSPORT, get_transport
+from .schemas.ckan import schema as ckan_schema, resource_schema as ckan_resource_schema
+from .schemas.dkan import schema as dkan_schema, resource_schema as dkan_resource_schema
 
 log = logging.getLogger(__name__)
 
 # dkan is a dummy value for dkan that does not provide resource_type
 ALLOWED_RESOURCE_TYPES = ('dkan', 'file', 'file.upload', 'api', 'metadata')
 
+# Package fields needed to list datasets
+LISTING_FIELDS = ('id', 'name', 'metadata_modified')
+# Stable listing order: unlike the default relevance and modification date order,
+# it is not changed by packages updates while paginating
+LISTING_SORT = 'id asc'
+
+# Default expiration of a full harvest lock, in seconds
+DEFAULT_LOCK_TIMEOUT = 6 * 60 * 60
+# Default delta harvest time budget, in seconds
+DEFAULT_DELTA_TIME_BUDGET = 4 * 60
+# Delay a delta harvest lock outlives its time budget, in seconds
+DELTA_LOCK_MARGIN = 60
+# Delay between two checks of a running delta harvest lock by a full harvest, in seconds
+LOCK_POLL_INTERVAL = 1
+# Default delay remote capabilities are cached, in seconds
+DEFAULT_PROBE_TTL = 24 * 60 * 60
+# Upper bounds of the requests latency histograms buckets, in seconds
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Maximum number of validation errors groups in a run summary
+MAX_ERROR_GROUPS = 100
+# Number of failing items remote ids kept per validation errors group
+ERROR_SAMPLE_SIZE = 10
+# Default delay known failing packages are not processed again, in seconds
+DEFAULT_FAILURE_CACHE_TTL = 24 * 60 * 60
+# Version of the resources mapping, part of their fingerprint:
+# bump it when the mapping changes so unchanged remote resources are mapped again
+MAPPING_VERSION = 1
+
+
+def resource_fingerprint(resource):
+    '''A digest of a raw CKAN resource and its mapping, detecting changed resources between runs'''
+    raw = json.dumps([MAPPING_VERSION, resource], sort_keys=True, separators=(',', ':'),
+                     default=str)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+def shard_of(key, count):
+    '''
+    The shard of a package `key` among `count` ones.
+
+    Unlike `hash()`, randomized per process, it is the same across runs and hosts.
+    '''
+    digest = hashlib.sha1(str(key).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % count
+
+
+def is_permanent_failure(error):
+    '''
+    Whether a package processing `error` happens again as long as the package is unchanged,
+    unlike network errors, timeouts or server errors.
+    '''
+    if isinstance(error, (HarvestSkipException, HarvestValidationError)):
+        return True
+    if isinstance(error, HTTPError):
+        return error.response is not None and error.response.status_code == 404
+    # CKAN versions answering errors with a 200 status
+    return isinstance(error, HarvestException) and str(error).startswith('Not Found Error')
+
+
+def is_transient(error):
+    '''Whether a request `error` may not happen again, ie. a network or server error'''
+    if isinstance(error, HTTPError):
+        return error.response is None or error.response.status_code >= 500
+    return isinstance(error, RequestException) and not isinstance(error, ValueError)
+
+
+def parse_version(version):
+    '''Parse a `major.minor[.patch]` version string into a tuple of ints, if valid'''
+    match = re.match(r'(\d+)\.(\d+)(?:\.(\d+))?', version or '')
+    if match:
+        return tuple(int(part) for part in match.groups() if part is not None)
+
+
+def wire_size(response):
+    '''Size of a response body as transferred, before decompression'''
+    try:
+        size = response.raw.tell()
+    except Exception:
+        size = None
+    return size or int(response.headers.get('Content-Length') or 0) or len(response.content)
+
 
 class CkanBackend(BaseBackend):
     display_name = 'CKAN'
@@ -38,12 +138,148 @@ class CkanBackend(BaseBackend):
         HarvestFilter(_('Organization'), 'organization', str,
                       _('A CKAN Organization name')),
         HarvestFilter(_('Tag'), 'tags', str, _('A CKAN tag name')),
+        HarvestFilter(_('Group'), 'groups', str, _('A CKAN group name')),
+        HarvestFilter(_('Resource format'), 'res_format', str,
+                      _('A CKAN resource format (ie. CSV)')),
+        HarvestFilter(_('License'), 'license_id', str, _('A CKAN license identifier')),
+        HarvestFilter(_('Modified since'), 'modified_since', str,
+                      _('An UTC date (or date and time), only datasets modified since are '
+                        'included (or excluded)')),
+    )
+    features = (
+        HarvestFeature('activity_sync', _('Incremental sync'),
+                       _('Only harvest packages changed since the last run '
+                         'from the recently changed packages activities')),
+        HarvestFeature('failure_cache', _('Skip known failures'),
+                       _('Do not process again failing packages until they are modified')),
+        HarvestFeature('probe', _('Adaptive strategy'),
+                       _('Probe the remote capabilities to select the listing strategy')),
+        HarvestFeature('spatial_pipeline', _('Simplify spatial geometries'),
+                       _('Validate, deduplicate and simplify spatial geometries')),
+    )
+    extra_configs = (
+        HarvestExtraConfig(_('Extras aliases'), 'extras_aliases', str,
+                           _('Comma-separated remote_key=key pairs handling site-specific '
+                             'extras as known ones (ie. update_frequency=frequency)')),
+        HarvestExtraConfig(_('Spatial tolerance'), 'spatial_tolerance', str,
+                           _('Geometries simplification tolerance in degrees')),
+        HarvestExtraConfig(_('Spatial vertices budget'), 'spatial_max_vertices', int,
+                           _('Maximum number of vertices of a simplified geometry')),
+        HarvestExtraConfig(_('Resources limit'), 'max_resources', int,
+                           _('Maximum number of harvested resources per dataset')),
     )
     schema = ckan_schema
+    resource_schema = ckan_resource_schema
+    # Listing page size, package_search rows are capped to 1000 as per
+    # https://docs.ckan.org/en/latest/api/#ckan.logic.action.get.package_search
+    page_size = 1000
+    # Activities page size, capped by CKAN `ckan.activity_list_limit` (100 max)
+    activities_page_size = 100
+    # Whether package_search supports restricting returned fields with `fl`
+    supports_fl = True
+    # Whether package_search supports filtering with `fq`
+    supports_fq = True
+    # Whether package_search supports sorting with `sort`
+    supports_sort = True
+
+    def __init__(self, *args, **kwargs):
+        super(CkanBackend, self).__init__(*args, **kwargs)
+        # Run metrics, mirrored in the job data
+        self.metrics = {}
+        # Whether this run only processes changed packages
+        self.incremental = False
+        # Whether this run is a time-boxed delta harvest, and its `time.monotonic()` deadline
+        self.delta = False
+        self.deadline = None
+        # Validation errors grouped by path and message
+        self.validation_errors = {}
+        # Whether the listing ended before all the remote packages were listed
+        self.incomplete = False
+        # The last package processing error
+        self.error = None
+        # Organizations and groups validated during this run, by type and id
+        self.references = {}
+        # An optional `HarvestProfiler` profiling this run
+        self.profiler = None
+        # An optional dump file path replayed instead of the remote API
+        self.dump = None
+        # An optional function writing the validated packages of this run
+        self.snapshot = None
+        # An optional `(index, count)` shard of the packages processed by this run
+        self.shard = None
+
+    def has_feature(self, key):
+        '''Features not provided by a backend (ie. activities on DKAN) are disabled'''
+        if not any(feature.key == key for feature in self.features):
+            return False
+        return super(CkanBackend, self).has_feature(key)
+
+    def incr_metric(self, section, *path, **counters):
+        '''Increment the counters of a metrics `section`, nested under `path` keys'''
+        metrics = self.metrics.setdefault(section, {})
+        for key in path:
+            metrics = metrics.setdefault(key, {})
+        for key, value in counters.items():
+            metrics[key] = metrics.get(key, 0) + value
+        if self.job is not None:
+            self.job.data[section] = self.metrics[section]
+
+    @cached_property
+    def extras_handlers(self):
+        '''
+        The extras dispatch table for this source: registered handlers
+        and the source `extras_aliases` mapping remote keys to handled ones.
+        '''
+        handlers = dict(EXTRAS_HANDLERS)
+        aliases = self.get_extra_config_value('extras_aliases') or ''
+        for alias in aliases.split(','):
+            if not alias.strip():
+                continue
+            remote_key, _sep, key = (part.strip() for part in alias.partition('='))
+            if key in EXTRAS_HANDLERS:
+                handlers[remote_key] = EXTRAS_HANDLERS[key]
+            else:
+                log.warning('Unknown extra "%s" for alias "%s"', key, remote_key)
+        return handlers
+
+    @cached_property
+    def geometries(self):
+        '''The spatial geometries pipeline for this source'''
+        tolerance = self.get_extra_config_value('spatial_tolerance')
+        max_vertices = self.get_extra_config_value('spatial_max_vertices')
+        return GeometryPipeline(
+            tolerance=DEFAULT_TOLERANCE if tolerance is None else float(tolerance),
+            max_vertices=DEFAULT_MAX_VERTICES if max_vertices is None else int(max_vertices),
+        )
+
+    @cached_property
+    def transport(self):
+        '''The transport performing this run requests, given the `CKAN_TRANSPORT` setting'''
+        return get_transport(current_app.config.get('CKAN_TRANSPORT', DEFAULT_TRANSPORT),
+                             **current_app.config.get('CKAN_TRANSPORT_OPTIONS', {}))
+
+    def request(self, method, url, headers=None, **kwargs):
+        '''Perform a request through the transport'''
+        headers = dict(headers or {}, **self.get_headers())
+        kwargs.setdefault('verify', self.verify_ssl)
+        return self.transport.request(method, url, headers=headers, **kwargs)
+
+    def head(self, url, headers=None, **kwargs):
+        return self.request('HEAD', url, headers=headers, **kwargs)
+
+    def get(self, url, headers=None, **kwargs):
+        return self.request('GET', url, headers=headers, **kwargs)
+
+    def post(self, url, data, headers=None, **kwargs):
+        return self.request('POST', url, headers=headers, data=data, **kwargs)
 
     def get_headers(self):
         headers = super(CkanBackend, self).get_headers()
         headers['content-type'] = 'application/json'
+        # Let urllib3 negotiate every compression it is able to decode:
+        # gzip and deflate (as requests already does), Brotli with `udata-ckan[brotli]`
+        # and Zstandard with urllib3 2 and `udata-ckan[zstd]`
+        headers['Accept-Encoding'] = ACCEPT_ENCODING
         if self.config.get('apikey'):
             headers['Authorization'] = self.config['apikey']
         return headers
@@ -56,19 +292,45 @@ class CkanBackend(BaseBackend):
         path = '/'.join(['dataset', name])
         return urljoin(self.source.url, path)
 
+    def observe_latency(self, endpoint, duration):
+        '''Count a request `duration` in the `endpoint` latency histogram'''
+        histogram = self.metrics.setdefault('latency', {}).setdefault(
+            endpoint, [0] * (len(LATENCY_BUCKETS) + 1)
+        )
+        histogram[bisect_left(LATENCY_BUCKETS, duration)] += 1
+        if self.job is not None:
+            self.job.data['latency'] = self.metrics['latency']
+
     def get_action(self, endpoint, fix=False, **kwargs):
         url = self.action_url(endpoint)
-        if fix:
-            response = self.post(url, '{}', params=kwargs)
-        else:
-            response = self.get(url, params=kwargs)
+        start = time.monotonic()
+        try:
+            if fix:
+                response = self.post(url, '{}', params=kwargs)
+            else:
+                response = self.get(url, params=kwargs)
+            duration = time.monotonic() - start
+            self.observe_latency(endpoint, duration)
+            # Body is decompressed on the fly while read
+            self.incr_metric('transfer', endpoint, requests=1, wire=wire_size(response),
+                             decoded=len(response.content), time=round(duration, 3))
+            start = time.monotonic()
+            data = self.parse_action(url, response)
+            self.incr_metric('transfer', endpoint, parsing=round(time.monotonic() - start, 3))
+            return data
+        except Exception:
+            self.incr_metric('transfer', endpoint, errors=1)
+            raise
 
+    def parse_action(self, url, response):
+        '''Extract an action API response, raising on errors'''
         response.raise_for_status()
         content_type = response.headers.get('Content-Type', '')
         mime_type = content_type.split(';', 1)[0]
 
         if mime_type == 'application/json':  # Standard API JSON response
-            data = response.json()
+            # Decoded from the raw bytes, with orjson if installed
+            data = loads(response.content)
             # CKAN API can returns 200 even on errors
             # Only the `success` property allows to detect errors
             if data.get('success', False):
@@ -98,40 +360,660 @@ class CkanBackend(BaseBackend):
         response = self.get(url)
         return response.json()
 
+    @property
+    def probe_key(self):
+        return 'udata-ckan:capabilities:{0}'.format(self.source.id)
+
+    def probe(self):
+        '''
+        The remote capabilities, probed once per `CKAN_PROBE_TTL` seconds for each source.
+
+        Unknown capabilities are `None`.
+        A probe interrupted by transient errors (network errors or server errors)
+        is not cached and probed again by the next run.
+        '''
+        capabilities = cache.get(self.probe_key)
+        if capabilities is None:
+            capabilities = self.inner_probe()
+            if capabilities.pop('complete'):
+                ttl = current_app.config.get('CKAN_PROBE_TTL', DEFAULT_PROBE_TTL)
+                cache.set(self.probe_key, capabilities, timeout=ttl)
+        return capabilities
+
+    def probe_action(self, capabilities, endpoint, **kwargs):
+        '''
+        The result of an action if it succeeds, `False` if the remote rejects it
+        and `None` on transient errors, marking the probe as incomplete.
+        '''
+        try:
+            return self.get_action(endpoint, **kwargs)['result']
+        except Exception as e:
+            if is_transient(e):
+                log.warning('Unable to probe %s: %s', endpoint, e)
+                capabilities['complete'] = False
+                return None
+            log.debug('%s rejected %s: %s', endpoint, ', '.join(kwargs), e)
+            return False
+
+    def inner_probe(self):
+        '''
+        Probe the remote version, `package_search` parameters support
+        and maximum number of rows (`ckan.search.rows_max`).
+
+        Latency and compression are only informative, reported in the job data.
+        '''
+        capabilities = dict.fromkeys(('version', 'latency', 'compression', 'fl', 'fq', 'sort',
+                                      'rows_max'))
+        capabilities['complete'] = True
+        start = time.monotonic()
+        try:
+            response = self.get(self.action_url('status_show'))
+            response.raise_for_status()
+            status = response.json()['result']
+        except Exception as e:
+            log.debug('status_show not available, trying legacy status: %s', e)
+            try:
+                start = time.monotonic()
+                response = self.get(urljoin(self.source.url, '/api/util/status'))
+                response.raise_for_status()
+                status = response.json()
+            except Exception as e:
+                log.warning('Unable to probe the remote status: %s', e)
+                response, status = None, {}
+                if is_transient(e):
+                    capabilities['complete'] = False
+        if response is not None:
+            capabilities['latency'] = round(time.monotonic() - start, 3)
+            capabilities['compression'] = response.headers.get('Content-Encoding')
+        if isinstance(status, dict):
+            capabilities['version'] = status.get('ckan_version')
+
+        # Servers not supporting `fl` ignore it and return full packages
+        result = self.probe_action(capabilities, 'package_search', rows=1,
+                                   fl=','.join(LISTING_FIELDS))
+        if result is False:
+            capabilities['fl'] = False
+        elif result and result['results']:
+            capabilities['fl'] = set(result['results'][0]) <= set(LISTING_FIELDS)
+
+        for key, params in (('fq', {'fq': '+name:*'}), ('sort', {'sort': LISTING_SORT})):
+            result = self.probe_action(capabilities, 'package_search', rows=0, **params)
+            if result is not None:
+                capabilities[key] = result is not False
+
+        if capabilities['fl']:
+            # Servers cap the returned rows silently
+            result = self.probe_action(capabilities, 'package_search', rows=self.page_size,
+                                       fl='id')
+            if result:
+                returned = len(result['results'])
+                if returned < min(result.get('count') or 0, self.page_size):
+                    capabilities['rows_max'] = returned
+        return capabilities
+
+    def apply_capabilities(self, capabilities):
+        '''Select the strategy matching the remote `capabilities` and return `fix`'''
+        if self.job is not None:
+            self.job.data['capabilities'] = capabilities
+        for key in 'fl', 'fq', 'sort':
+            if capabilities.get(key) is not None:
+                setattr(self, 'supports_{0}'.format(key), capabilities[key])
+        if capabilities.get('rows_max'):
+            self.page_size = min(self.page_size, capabilities['rows_max'])
+        version = parse_version(capabilities['version'])
+        # CKAN < 1.8 only accepts POST requests on its action API
+        return bool(version and version < (1, 8))
+
+    def search_query(self):
+        '''Build a package_search filter query from the source filters if any'''
+        return build_query(self.config.get('filters', []))
+
+    def iter_listing(self, fix=False):
+        '''
+        Yield the remote datasets as `(name, id, metadata_modified)`, page by page.
+
+        `id` and `metadata_modified` are only known (otherwise `None`)
+        when listing with `package_search`, ie. for filtered or sharded sources
+        or when known failures are skipped.
+        `package_search` is sorted by id so packages updated during the run
+        do not move between pages. Packages created or deleted during the run
+        still shift the following ones with offset pagination:
+        some can be listed twice or missed until the next run.
+
+        The raw response of each page is dropped before its packages are yielded
+        so only a single page is held in memory, and no more page is fetched
+        as soon as the consumer stops iterating.
+        '''
+        fq = self.search_query()
+        if fq or self.shard or self.has_feature('failure_cache'):
+            # use package_search because package_list doesn't allow filtering
+            # nor returns the packages ids and modification dates
+            params = {'fq': fq} if fq else {}
+            params['rows'] = self.page_size
+            if self.supports_sort:
+                params['sort'] = LISTING_SORT
+            yield from self.iter_pages('package_search', 'start', fix=fix, **params)
+        else:
+            yield from self.iter_pages('package_list', 'offset', fix=fix,
+                                       limit=self.page_size)
+
+    def package_search(self, fix=False, fields=LISTING_FIELDS, fq=None, **kwargs):
+        '''
+        Search packages matching the `fq` filter query if any, only fetching `fields` if any.
+
+        Filters are given as a `fq` filter query, neither scored nor parsed as full text,
+        and cached by Solr. CKAN versions not supporting `fl` ignore it and return
+        full packages, which still works.
+        If a server fails, the query is first sent as `q` instead of `fq`,
+        then without `fl`: the first working combination is kept for the whole run.
+        '''
+        use_fl = bool(fields) and self.supports_fl
+        attempts = [(self.supports_fq, use_fl)]
+        if fq and self.supports_fq:
+            attempts.append((False, use_fl))
+        if use_fl:
+            attempts.extend([(use_fq, False) for use_fq, _ in attempts])
+        for index, (use_fq, with_fl) in enumerate(attempts):
+            params = {('fq' if use_fq else 'q'): fq} if fq else {}
+            params.update(kwargs)
+            if with_fl:
+                params['fl'] = ','.join(fields)
+            try:
+                response = self.get_action('package_search', fix=fix, **params)
+            except (HarvestException, HTTPError) as e:
+                if index + 1 == len(attempts):
+                    raise
+                log.warning('package_search failed with %s, retrying: %s',
+                            ', '.join(params), e)
+                continue
+            if fq and not use_fq and self.supports_fq:
+                log.warning('package_search does not support `fq`, using `q`')
+                self.supports_fq = False
+            if use_fl and not with_fl:
+                log.warning('package_search does not support `fl`, fetching full packages')
+                self.supports_fl = False
+            return response
+
+    def iter_pages(self, endpoint, offset_param, fix=False, **kwargs):
+        '''Yield `(name, id, metadata_modified)` from a paginated listing endpoint'''
+        offset = 0
+        first = None
+        while True:
+            params = dict(kwargs, **{offset_param: offset}) if offset else kwargs
+            if endpoint == 'package_search':
+                response = self.package_search(fix=fix, **params)
+            else:
+                response = self.get_action(endpoint, fix=fix, **params)
+            result = response['result']
+            if isinstance(result, dict):  # package_search
+                packages = [(r['name'], r.get('id') or None, r.get('metadata_modified') or None)
+                            for r in result['results']]
+                count = result.get('count')
+            else:  # package_list
+                packages = [(name, None, None) for name in result]
+                count = None
+            del response, result
+            if not packages or packages[0][0] == first:
+                # Empty page or pagination ignored by the server: we are done
+                if count is not None and offset < count:
+                    log.warning('Only %s packages out of %s listed', offset, count)
+                    self.incomplete = True
+                return
+            first = packages[0][0]
+            yield from packages
+            offset += len(packages)
+            if count is None and len(packages) > kwargs.get('limit', len(packages)):
+                # More names than requested: pagination ignored by the server,
+                # which returned everything at once
+                return
+            if count is not None and offset >= count:
+                # Everything listed: no need to fetch an empty page.
+                # Pages may be shorter than requested (ie. capped by `ckan.search.rows_max`)
+                # so only the total count tells the last one
+                return
+
     def inner_harvest(self):
         '''List all datasets for a given ...'''
+        if self.dump:
+            return self.inner_replay()
+
         fix = False  # Fix should be True for CKAN < '1.8'
+        if self.has_feature('probe') and not self.dryrun:
+            fix = self.apply_capabilities(self.probe())
 
-        filters = self.config.get('filters', [])
-        if len(filters) > 0:
-            # Build a q search query based on filters
-            # use package_search because package_list doesn't allow filtering
-            # use q parameters because fq is broken with multiple filters
-            params = []
-            for f in filters:
-                param = '{key}:{value}'.format(**f)
-                if f.get('type') == 'exclude':
-                    param = '-' + param
-                params.append(param)
-            q = ' AND '.join(params)
-            # max out rows count to 1000 as per
-            # https://docs.ckan.org/en/latest/api/#ckan.logic.action.get.package_search
-            response = self.get_action('package_search', fix=fix, q=q, rows=1000)
-            names = [r['name'] for r in response['result']['results']]
-        else:
-            response = self.get_action('package_list', fix=fix)
-            names = response['result']
+        if self.dryrun and self.max_items:
+            try:
+                return self.inner_preview(fix=fix)
+            except (HarvestException, HTTPError) as e:
+                log.warning('Fast preview failed, falling back on full listing: %s', e)
+
+        if self.delta:
+            return self.inner_sync(self.last_checkpoint(), self.iter_activities(fix=fix))
 
-        for name in names:
+        if self.has_feature('activity_sync') and not self.dryrun and not self.shard:
+            # Sharded runs would record a checkpoint for their share of the packages only
+            if self.search_query():
+                log.warning('Activity sync ignores filters, performing a full harvest')
+            else:
+                checkpoint = self.last_checkpoint()
+                activities = self.iter_activities(fix=fix)
+                try:
+                    latest = next(activities, None)
+                except (HarvestException, HTTPError) as e:
+                    log.warning('Unable to fetch recently changed packages activities: %s', e)
+                    latest = None
+                if checkpoint and latest:
+                    return self.inner_sync(checkpoint, chain([latest], activities))
+                # First run (or activities not available): full harvest
+                if latest:
+                    self.job.data['activity_checkpoint'] = latest.get('timestamp')
+
+        for name, package_id, modified in self.iter_listing(fix=fix):
             # We use `name` as `remote_id` for now, we'll be replace at the beginning of the process
-            self.process_dataset(name)
+            self.process_package(name, package_id, modified)
+            if self.has_reached_max_items():
+                # Partial harvest: next runs can't rely on this one
+                self.job.data.pop('activity_checkpoint', None)
+                return
+        if self.incomplete:
+            # Packages not listed would never be harvested by the next incremental runs
+            self.job.data.pop('activity_checkpoint', None)
+
+    def inner_replay(self):
+        '''Process the packages of the `dump` file instead of fetching them'''
+        log.info('Replaying dump %s', self.dump)
+        for package in iter_packages(self.dump):
+            self.process_package(package.get('name'), package.get('id'),
+                                 package.get('metadata_modified'), package=package)
             if self.has_reached_max_items():
                 return
 
-    def inner_process_dataset(self, item: HarvestItem):
-        response = self.get_action('package_show', id=item.remote_id)
+    def failure_key(self, package_id):
+        return 'udata-ckan:failure:{0}:{1}'.format(self.source.id, package_id)
+
+    def in_shard(self, key):
+        '''Whether a package, given its id (or name if unknown), belongs to this run shard'''
+        return self.shard is None or shard_of(key, self.shard[1]) == self.shard[0]
+
+    def process_package(self, remote_id, package_id=None, modified=None, **kwargs):
+        '''
+        Process a listed package, unless it belongs to another shard
+        or it is known to fail as is.
+
+        Packages skipped or permanently failing (not found or invalid) are remembered
+        with their `metadata_modified` (if known from the listing)
+        for `CKAN_FAILURE_CACHE_TTL` seconds, and not processed again during this delay
+        unless modified. Transient failures (ie. network errors) are retried by the next run.
+        '''
+        if not self.in_shard(package_id or remote_id):
+            self.incr_metric('shard', others=1)
+            return
+        use_cache = self.has_feature('failure_cache') and package_id and modified
+        if use_cache:
+            failure = cache.get(self.failure_key(package_id))
+            if failure and failure['modified'] == modified:
+                self.incr_metric('failures', cached=1)
+                self.record_item(package_id, failure['status'], message=failure['message'])
+                return
+        self.error = None
+        self.process_dataset(remote_id, **kwargs)
+        item = self.job.items[-1]
+        permanent = item.status == 'skipped' or (
+            item.status == 'failed' and is_permanent_failure(self.error)
+        )
+        if use_cache and not self.dryrun and permanent:
+            message = item.errors[0].message if item.errors else None
+            ttl = current_app.config.get('CKAN_FAILURE_CACHE_TTL', DEFAULT_FAILURE_CACHE_TTL)
+            cache.set(self.failure_key(package_id), {
+                'modified': modified,
+                'status': item.status,
+                'message': message,
+            }, timeout=ttl)
 
-        result = response["result"]
+    def iter_activities(self, fix=False):
+        '''
+        Yield the recently changed packages activities, newest first.
+
+        CKAN caps the activities page size (`ckan.activity_list_limit`)
+        so only an empty page ends the listing.
+        '''
+        offset = 0
+        while True:
+            params = {'limit': self.activities_page_size}
+            if offset:
+                params['offset'] = offset
+            response = self.get_action('recently_changed_packages_activity_list',
+                                       fix=fix, **params)
+            activities = response['result']
+            del response
+            if not activities:
+                return
+            offset += len(activities)
+            yield from activities
+
+    def last_checkpoint(self):
+        '''The activity checkpoint of the last successful job for this source'''
+        job = HarvestJob.objects(
+            source=self.source,
+            id__ne=self.job.id if self.job else None,
+            status__in=['done', 'done-errors'],
+            data__activity_checkpoint__exists=True,
+        ).order_by('-created').only('data').first()
+        return job.data['activity_checkpoint'] if job else None
+
+    def inner_sync(self, checkpoint, activities):
+        '''
+        Only process the packages changed since the `checkpoint` activity timestamp
+        given the recently changed packages `activities`, newest first.
+
+        Packages changed many times are processed once
+        and deleted packages datasets are archived.
+        '''
+        self.incremental = True
+        changes = {}
+        for activity in activities:
+            timestamp = activity.get('timestamp') or ''
+            if timestamp <= checkpoint:
+                break
+            package_id = activity.get('object_id')
+            # Activities are listed newest first: only the last one matters
+            if package_id and package_id not in changes:
+                changes[package_id] = (timestamp, activity.get('activity_type'))
+            if self.is_out_of_time():
+                # Older changes are not listed yet, they will all be retried by the next run
+                log.warning('Time budget exceeded while listing activities')
+                return
+
+        # Process the oldest changes first so the checkpoint follows the progress
+        changes = sorted((timestamp, package_id, activity_type)
+                         for package_id, (timestamp, activity_type) in changes.items())
+        done = checkpoint
+        failed = False
+        for index, (timestamp, package_id, activity_type) in enumerate(changes):
+            if self.has_reached_max_items() or self.is_out_of_time():
+                # Unprocessed changes will be processed by the next run
+                break
+            if activity_type == 'deleted package':
+                self.archive_dataset(package_id)
+            else:
+                self.process_dataset(package_id)
+                if self.job.items[-1].status not in ('done', 'skipped'):
+                    # The checkpoint stays before the first failed change
+                    # so the next run retries it (and processes again the following ones)
+                    failed = True
+            if not failed and (index + 1 == len(changes) or changes[index + 1][0] > timestamp):
+                done = timestamp
+
+        self.job.data['activity_checkpoint'] = done
+
+    def is_out_of_time(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def lock_key(self, kind):
+        return 'udata-ckan:harvest-lock:{0}:{1}'.format(self.source.id, kind)
+
+    def release_lock(self, kind, token):
+        '''
+        Release a lock held with `token`, unless it expired and was taken over meanwhile.
+
+        The check and the deletion are not atomic but a lock is only taken over
+        once expired or by a later full harvest, making a wrong deletion unlikely.
+        '''
+        if cache.get(self.lock_key(kind)) == token:
+            cache.delete(self.lock_key(kind))
+
+    def wait_for_delta(self):
+        '''Wait for a running delta harvest to end, at most its lock lifetime'''
+        budget = current_app.config.get('CKAN_DELTA_TIME_BUDGET', DEFAULT_DELTA_TIME_BUDGET)
+        deadline = time.monotonic() + budget + DELTA_LOCK_MARGIN
+        while cache.get(self.lock_key('delta')) is not None:
+            if time.monotonic() >= deadline:
+                log.warning('Delta harvest of source "%s" still running, starting anyway',
+                            self.source.name)
+                return
+            time.sleep(LOCK_POLL_INTERVAL)
+
+    def harvest(self):
+        '''
+        Harvest the source, once its running delta harvest is over.
+
+        The full harvest lock is set first so no other delta harvest starts meanwhile.
+        Concurrent full (or sharded) harvests share it: it is held by the last started.
+        '''
+        if self.dryrun:
+            if self.profiler is not None:
+                # Stopped on `end_job`
+                self.profiler.start()
+            return super(CkanBackend, self).harvest()
+        token = 'full:{0}'.format(uuid.uuid4().hex)
+        timeout = current_app.config.get('CKAN_HARVEST_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT)
+        cache.set(self.lock_key('full'), token, timeout=timeout)
+        try:
+            self.wait_for_delta()
+            if self.profiler is not None:
+                self.profiler.start()
+            return super(CkanBackend, self).harvest()
+        finally:
+            self.release_lock('full', token)
+
+    def harvest_delta(self, budget):
+        '''
+        Only harvest the packages changed since the last checkpoint, within `budget` seconds.
+
+        Nothing is done (and `None` returned) if the source is already being harvested,
+        has no activity checkpoint yet or has filters.
+        '''
+        if not any(feature.key == 'activity_sync' for feature in self.features):
+            log.info('No delta harvest for source "%s": its backend has no activities',
+                     self.source.name)
+            return
+        if self.search_query() or not self.last_checkpoint():
+            log.info('No delta harvest for source "%s" without checkpoint or with filters',
+                     self.source.name)
+            return
+        token = 'delta:{0}'.format(uuid.uuid4().hex)
+        if (cache.get(self.lock_key('full')) is not None
+                or not cache.add(self.lock_key('delta'), token,
+                                 timeout=int(budget) + DELTA_LOCK_MARGIN)):
+            log.info('Source "%s" is already being harvested, skipping delta', self.source.name)
+            return
+        self.delta = True
+        self.deadline = time.monotonic() + budget
+        if self.profiler is not None:
+            self.profiler.start()
+        try:
+            return super(CkanBackend, self).harvest()
+        finally:
+            self.release_lock('delta', token)
+
+    def archive_dataset(self, remote_id):
+        '''Archive the dataset harvested from a package deleted on the remote'''
+        dataset = Dataset.objects(harvest__source_id=str(self.source.id),
+                                  harvest__remote_id=remote_id).first()
+        if not dataset:
+            return
+        if not dataset.harvest.archived_at:
+            archive_harvested_dataset(dataset, reason='not-on-remote', dryrun=self.dryrun)
+        self.record_item(remote_id, 'archived', dataset=dataset)
+
+    def record_item(self, remote_id, status, dataset=None, message=None):
+        '''Add an item handled without `process_dataset` to the job'''
+        now = datetime.utcnow()
+        item = HarvestItem(remote_id=remote_id, status=status, dataset=dataset,
+                           started=now, ended=now)
+        if message:
+            item.errors.append(HarvestError(message=message))
+        self.job.items.append(item)
+        self.save_job()
+
+    def end_job(self):
+        duration = (datetime.utcnow() - self.job.started).total_seconds()
+        processed = sum(1 for item in self.job.items if item.status != 'archived')
+        self.job.data['throughput'] = {
+            'items': processed,
+            'duration': round(duration, 3),
+            'items_per_second': round(processed / duration, 3) if duration else None,
+        }
+        self.job.data['json_decoder'] = DECODER
+        if self.profiler is not None:
+            name = '{0}-{1}'.format(self.source.slug,
+                                    self.job.id or self.job.started.strftime('%Y%m%d%H%M%S'))
+            self.job.data['profile'] = self.profiler.stop(name)
+        if 'transport' in self.__dict__:
+            self.transport.close()
+            del self.transport
+        super(CkanBackend, self).end_job()
+
+    def process_dataset(self, remote_id, **kwargs):
+        if self.profiler is None:
+            return super(CkanBackend, self).process_dataset(remote_id, **kwargs)
+        with self.profiler.dataset(remote_id):
+            return super(CkanBackend, self).process_dataset(remote_id, **kwargs)
+
+    def autoarchive(self):
+        if self.incremental:
+            # Incremental runs only see changed packages,
+            # deleted ones are archived from their activities
+            return
+        if self.shard:
+            # Sharded runs only see their share of the packages
+            return
+        if self.dump:
+            # Dumps may be old, partial or only contain valid packages (snapshots)
+            return
+        if self.incomplete:
+            log.warning('Incomplete listing of source "%s", not archiving', self.source.name)
+            return
+        super(CkanBackend, self).autoarchive()
+
+    def inner_preview(self, fix=False):
+        '''
+        Preview the first `max_items` datasets with a single `package_search` request.
+
+        package_search returns the same packages as package_show
+        so they are processed directly without any further request.
+        '''
+        params = {'rows': self.max_items}
+        fq = self.search_query()
+        if fq:
+            params['fq'] = fq
+        response = self.package_search(fix=fix, fields=None, **params)
+        for package in response['result']['results'][:self.max_items]:
+            self.process_dataset(package.get('name'), package=package)
+
+    def strip_references(self, package):
+        '''
+        Remove the organization and groups already validated during this run from a package.
+
+        Return the package to validate and the references to remember once validated.
+        Organizations and groups are embedded in every package: they are only validated
+        on their first occurrence (or when changed) instead of once per package.
+        '''
+        references = {}
+        organization = package.get('organization')
+        if isinstance(organization, dict) and organization.get('id'):
+            key = ('organization', organization['id'])
+            if self.references.get(key) == organization:
+                package = dict(package, organization=None)
+                self.incr_metric('references', cached=1)
+            else:
+                references[key] = organization
+        groups = package.get('groups')
+        if isinstance(groups, list) and groups:
+            unknown = []
+            for group in groups:
+                key = ('group', group.get('id')) if isinstance(group, dict) else None
+                if key and self.references.get(key) == group:
+                    self.incr_metric('references', cached=1)
+                    continue
+                unknown.append(group)
+                if key and key[1]:
+                    references[key] = group
+            if len(unknown) < len(groups):
+                package = dict(package, groups=unknown)
+        return package, references
+
+    @cached_property
+    def max_resources(self):
+        '''The maximum number of harvested resources per dataset, if any'''
+        max_resources = self.get_extra_config_value('max_resources')
+        if max_resources is None:
+            max_resources = current_app.config.get('CKAN_MAX_RESOURCES')
+        return max_resources
+
+    def validate(self, data, schema, item=None, path=()):
+        '''
+        Validate `data` against `schema`.
+
+        Errors of a processed `item` are also aggregated in the run summary,
+        `path` being the position of `data` in the package.
+        '''
+        if item is None:
+            return super(CkanBackend, self).validate(data, schema)
+
+        def aggregating(value):
+            try:
+                return schema(value)
+            except MultipleInvalid as e:
+                for error in e.errors:
+                    self.aggregate_error(item, path + tuple(error.path), error)
+                raise
+        return super(CkanBackend, self).validate(data, aggregating)
+
+    def aggregate_error(self, item, path, error):
+        '''
+        Count a validation error by path (list positions ignored) and type,
+        keeping a bounded sample of the failing items remote ids.
+        '''
+        field = '.'.join('*' if isinstance(p, int) else str(p) for p in path)
+        key = (field, type(error).__name__)
+        group = self.validation_errors.get(key)
+        if group is None:
+            if len(self.validation_errors) >= MAX_ERROR_GROUPS:
+                self.incr_metric('validation', ungrouped=1)
+                return
+            # Messages may contain the invalid value: only the first one is kept
+            group = self.validation_errors[key] = {
+                'path': field, 'error': key[1], 'message': error.msg, 'count': 0, 'sample': [],
+            }
+        group['count'] += 1
+        if len(group['sample']) < ERROR_SAMPLE_SIZE and item.remote_id not in group['sample']:
+            group['sample'].append(item.remote_id)
+        self.incr_metric('validation', errors=1)
+        if self.job is not None:
+            self.job.data['validation_errors'] = sorted(self.validation_errors.values(),
+                                                        key=lambda g: -g['count'])
+
+    def validate_resource(self, item, index, resource):
+        '''Validate a single resource, reporting errors with its position'''
+        try:
+            return self.validate(resource, self.resource_schema, item, ('resources', index))
+        except HarvestValidationError as e:
+            prefix = '\n- [resources.{0}.'.format(index)
+            raise HarvestValidationError(str(e).replace('\n- [', prefix))
+
+    def get_dataset(self, remote_id):
+        if self.dryrun:
+            # Nothing is persisted on dry runs, don't lookup for an existing dataset
+            if self.source.organization:
+                return Dataset(organization=self.source.organization)
+            return Dataset(owner=self.source.owner)
+        return super(CkanBackend, self).get_dataset(remote_id)
+
+    def inner_process_dataset(self, item: HarvestItem, **kwargs):
+        try:
+            return self.map_package(item, **kwargs)
+        except Exception as e:
+            # Caught by `process_dataset`, kept to tell transient failures
+            self.error = e
+            raise
+
+    def map_package(self, item: HarvestItem, package=None):
+        if package is None:
+            response = self.get_action('package_show', id=item.remote_id)
+            package = response["result"]
+
+        result = package
         # DKAN returns a list where CKAN returns an object
         # we "unlist" here instead of after schema validation in order to get the id easily
         if type(result) is list:
@@ -141,10 +1023,17 @@ class CkanBackend(BaseBackend):
         if result.get("id"):
             item.remote_id = result["id"]
 
-        data = self.validate(result, self.schema)
+        # Resources are validated one at a time while mapped
+        # so huge resources lists are not held twice in memory
+        raw_package, raw_resources = result, result.get('resources')
+        if isinstance(raw_resources, list):
+            result = dict(result, resources=[])
+        result, references = self.strip_references(result)
+        data = self.validate(result, self.schema, item)
+        self.references.update(references)
 
         # Skip if no resource
-        if not len(data.get('resources', [])):
+        if not len(raw_resources):
             raise HarvestSkipException(f"Dataset {data['name']} has no record")
 
         dataset = self.get_dataset(item.remote_id)
@@ -164,63 +1053,28 @@ class CkanBackend(BaseBackend):
                                         data['license_title'],
                                         default=default_license)
 
-        dataset.tags = [t['name'] for t in data['tags'] if t['name']]
+        # Distinct tags may be normalized the same way
+        dataset.tags = list(dict.fromkeys(t['name'] for t in data['tags'] if t['name']))
 
         dataset.harvest.created_at = data['metadata_created']
         dataset.harvest.modified_at = data['metadata_modified']
 
         dataset.harvest.ckan_name = data['name']
 
-        temporal_start, temporal_end = None, None
-        spatial_geom, spatial_zone = None, None
-
+        state = {}
+        handlers = self.extras_handlers
         for extra in data['extras']:
-            key = extra['key']
             value = extra['value']
             if value is None or (
                 isinstance(value, str) and not value.strip()
             ):
                 # Skip empty extras
                 continue
-            elif key == 'spatial':
-                # GeoJSON representation (Polygon or Point)
-                spatial_geom = json.loads(value)
-            elif key == 'spatial-text':
-                # Textual representation of the extent / location
-                qs = GeoZone.objects(db.Q(name=value) | db.Q(slug=value))
-                if qs.count() == 1:
-                    spatial_zone = qs.first()
-                else:
-                    dataset.extras['ckan:spatial-text'] = value
-                    log.debug('spatial-text value not handled: %s', value)
-            elif key == 'spatial-uri':
-                # Linked Data URI representing the place name
-                dataset.extras['ckan:spatial-uri'] = value
-                log.debug('spatial-uri value not handled: %s', value)
-            elif key == 'frequency':
-                # Update frequency
-                freq = frequency_from_rdf(value)
-                if freq:
-                    dataset.frequency = freq
-                elif value in UPDATE_FREQUENCIES:
-                    dataset.frequency = value
-                else:
-                    dataset.extras['ckan:frequency'] = value
-                    log.debug('frequency value not handled: %s', value)
-            # Temporal coverage start
-            elif key == 'temporal_start':
-                temporal_start = daterange_start(value)
-            # Temporal coverage end
-            elif key == 'temporal_end':
-                temporal_end = daterange_end(value)
-            else:
-                dataset.extras[extra['key']] = value
-
-        if spatial_geom or spatial_zone:
-            dataset.spatial = SpatialCoverage()
+            key = extra['key']
+            handlers.get(key, store_extra)(self, dataset, key, value, state)
 
-        if spatial_zone:
-            dataset.spatial.zones = [spatial_zone]
+        spatial_geom, spatial_zone = state.get('spatial_geom'), state.get('spatial_zone')
+        temporal_start, temporal_end = state.get('temporal_start'), state.get('temporal_end')
 
         if spatial_geom:
             if spatial_geom['type'] == 'Polygon':
@@ -229,10 +1083,23 @@ class CkanBackend(BaseBackend):
                 coordinates = spatial_geom['coordinates']
             else:
                 raise HarvestException('Unsupported spatial geometry')
-            dataset.spatial.geom = {
+            spatial_geom = {
                 'type': 'MultiPolygon',
                 'coordinates': coordinates
             }
+            if self.has_feature('spatial_pipeline'):
+                spatial_geom = self.geometries.process(spatial_geom, state.get('spatial_raw'))
+                if self.job is not None:
+                    self.job.data['spatial'] = dict(self.geometries.metrics)
+
+        if spatial_geom or spatial_zone:
+            dataset.spatial = SpatialCoverage()
+
+        if spatial_zone:
+            dataset.spatial.zones = [spatial_zone]
+
+        if spatial_geom:
+            dataset.spatial.geom = spatial_geom
 
         if temporal_start and temporal_end:
             dataset.temporal_coverage = db.DateRange(
@@ -252,19 +1119,52 @@ class CkanBackend(BaseBackend):
                 dataset.harvest.remote_url = url
 
         # Resources
-        for res in data['resources']:
-            if res['resource_type'] not in ALLOWED_RESOURCE_TYPES:
-                continue
+        max_resources = self.max_resources
+        resources = {resource.id: resource for resource in dataset.resources}
+        for index, raw in enumerate(raw_resources):
+            if max_resources and index >= max_resources:
+                overflow = len(raw_resources) - max_resources
+                log.warning('Dataset %s has %s resources over the %s resources limit',
+                            data['name'], overflow, max_resources)
+                self.incr_metric('resources', overflow=overflow)
+                item.errors.append(HarvestError(message=(
+                    '{0} resources over the {1} resources limit were not harvested'
+                ).format(overflow, max_resources)))
+                break
+            if self.snapshot is None:
+                # Release each raw resource as soon as it is handled,
+                # unless the whole package is snapshotted once mapped
+                raw_resources[index] = None
             try:
-                resource = get_by(dataset.resources, 'id', UUID(res['id']))
+                resource = resources.get(UUID(raw.get('id')))
             except Exception:
-                log.error('Unable to parse resource ID %s', res['id'])
+                # Reported below once validated
+                resource = None
+            fingerprint = resource_fingerprint(raw)
+            # Dumps are replayed to map their packages again, whatever their fingerprints
+            if not self.dump and resource and resource.harvest and \
+                    getattr(resource.harvest, 'ckan_fingerprint', None) == fingerprint:
+                # Untouched resources are left alone so they are not rewritten
+                self.incr_metric('resources', unchanged=1)
+                continue
+            res = self.validate_resource(item, index, raw)
+            if res['resource_type'] not in ALLOWED_RESOURCE_TYPES:
                 continue
-            if not resource:
+            if resource is None:
+                try:
+                    UUID(res['id'])
+                except Exception:
+                    log.error('Unable to parse resource ID %s', res['id'])
+                    continue
+            if resource:
+                self.incr_metric('resources', updated=1)
+            else:
+                self.incr_metric('resources', created=1)
                 resource = Resource(id=res['id'])
                 dataset.resources.append(resource)
             if not resource.harvest:
                 resource.harvest = HarvestResourceMetadata()
+            resource.harvest.ckan_fingerprint = fingerprint
             resource.title = res.get('name', '') or ''
             resource.description = parse_html(res.get('description'))
             resource.url = res['url']
@@ -275,9 +1175,62 @@ class CkanBackend(BaseBackend):
             resource.harvest.created_at = res['created']
             resource.harvest.modified_at = res['last_modified']
 
+        if self.snapshot is not None:
+            self.snapshot(raw_package)
+
         return dataset
 
 
 class DkanBackend(CkanBackend):
     schema = dkan_schema
+    resource_schema = dkan_resource_schema
     filters = []
+    # DKAN neither provides activities nor the probed CKAN capabilities
+    # and the bulk listing needs no listing strategy
+    features = tuple(f for f in CkanBackend.features if f.key not in ('activity_sync', 'probe'))
+    # Pages contain full packages with their resources
+    page_size = 100
+
+    def iter_packages(self):
+        '''
+        Yield full packages, page by page, from `current_package_list_with_resources`.
+
+        DKAN may cap the requested limit so only an empty page ends the listing.
+        '''
+        offset = 0
+        first = None
+        while True:
+            limit = self.page_size
+            if self.max_items:
+                limit = min(limit, self.max_items)
+            response = self.get_action('current_package_list_with_resources',
+                                       limit=limit, offset=offset)
+            packages = response['result']
+            del response
+            if packages and isinstance(packages[0], list):
+                # Some DKAN versions wrap the page in a list
+                packages = packages[0]
+            if not packages or packages[0].get('id') == first:
+                # Empty page or pagination ignored by the server: we are done
+                return
+            first = packages[0].get('id')
+            offset += len(packages)
+            yield from packages
+
+    def inner_harvest(self):
+        '''Process datasets in bulk, without a request per dataset'''
+        if self.dump or self.delta:
+            return super(DkanBackend, self).inner_harvest()
+        packages = self.iter_packages()
+        try:
+            package = next(packages, None)
+        except (HarvestException, HTTPError) as e:
+            log.warning('Bulk listing failed, falling back on package_list: %s', e)
+            return super(DkanBackend, self).inner_harvest()
+
+        while package is not None:
+            self.process_package(package.get('name'), package.get('id'),
+                                 package.get('metadata_modified'), package=package)
+            if self.has_reached_max_items():
+                return
+            package = next(packages, None)
@@ -0,0 +1,95 @@
+'''
+CPU and memory profiling of a single harvest run
+'''
+import cProfile
+import json
+import logging
+import os
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Number of slowest datasets and memory allocation sites reported
+DEFAULT_TOP = 20
+# Frames kept per traced memory allocation
+TRACEMALLOC_FRAMES = 10
+
+
+class HarvestProfiler(object):
+    '''
+    Profile a harvest run, writing its artifacts in `directory`:
+
+    - `<name>.prof`: the run cProfile statistics (readable with `pstats` or snakeviz)
+    - `<name>-memory.txt`: the top memory allocation sites grown during the run
+    - `<name>-datasets.json`: the slowest and most memory hungry datasets
+
+    Memory tracing (`tracemalloc`) slows the run down and can be disabled.
+    '''
+    def __init__(self, directory, memory=True, top=DEFAULT_TOP):
+        self.directory = directory
+        self.memory = memory
+        self.top = top
+        self.profile = None
+        self.snapshot = None
+        self.started = None
+        self.datasets = []
+
+    def start(self):
+        if self.memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self.snapshot = tracemalloc.take_snapshot()
+        self.profile = cProfile.Profile()
+        self.started = time.monotonic()
+        self.profile.enable()
+
+    @contextmanager
+    def dataset(self, remote_id):
+        '''Measure the duration and memory peak of a dataset processing'''
+        if self.memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            measure = {'remote_id': remote_id, 'duration': round(time.monotonic() - start, 6)}
+            if self.memory:
+                measure['peak'] = tracemalloc.get_traced_memory()[1] - baseline
+            self.datasets.append(measure)
+
+    def stop(self, name):
+        '''Stop profiling and write the artifacts, returning a summary with their paths'''
+        self.profile.disable()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, name)
+        summary = {
+            'duration': round(time.monotonic() - self.started, 3),
+            'datasets': len(self.datasets),
+            'cpu': '{0}.prof'.format(path),
+        }
+        self.profile.dump_stats(summary['cpu'])
+
+        report = {
+            'slowest': sorted(self.datasets, key=lambda d: -d['duration'])[:self.top],
+        }
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            stats = tracemalloc.take_snapshot().compare_to(self.snapshot, 'traceback')
+            tracemalloc.stop()
+            summary.update(memory_current=current, memory_peak=peak,
+                           memory='{0}-memory.txt'.format(path))
+            with open(summary['memory'], 'w') as out:
+                for stat in stats[:self.top]:
+                    out.write('{0}\n'.format(stat))
+                    out.write('\n'.join(stat.traceback.format()))
+                    out.write('\n\n')
+            report['hungriest'] = sorted(self.datasets, key=lambda d: -d['peak'])[:self.top]
+
+        summary['report'] = '{0}-datasets.json'.format(path)
+        with open(summary['report'], 'w') as out:
+            json.dump(report, out, indent=2)
+        log.info('Profile artifacts written in %s', self.directory)
+        return summary
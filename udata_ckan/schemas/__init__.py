@@ -0,0 +1,21 @@
+'''
+Validators shared by the CKAN and DKAN schemas
+'''
+from functools import lru_cache
+
+from udata.harvest import filters
+
+# Portals reuse a small vocabulary of tags and organizations names
+# across their datasets: normalized names are memoized.
+# Normalizations are pure functions so the caches are shared by all the runs of a process.
+NAMES_CACHE_SIZE = 4096
+
+
+@lru_cache(maxsize=NAMES_CACHE_SIZE)
+def normalize_tag(value):
+    return filters.normalize_tag(value)
+
+
+@lru_cache(maxsize=NAMES_CACHE_SIZE)
+def slug(value):
+    return filters.slug(value)
@@ -2,10 +2,11 @@ from voluptuous import (
     Schema, All, Any, Lower, Coerce, DefaultTo, Optional
 )
 from udata.harvest.filters import (
-    boolean, email, to_date, slug, normalize_tag, normalize_string,
-    is_url, empty_none, hash
+    boolean, email, to_date, normalize_string, is_url, empty_none, hash
 )
 
+from . import normalize_tag, slug
+
 RESOURCE_TYPES = ('file', 'file.upload', 'api', 'documentation',
                   'image', 'visualization')
 
@@ -78,3 +79,6 @@ schema = Schema({
     'maintainer_email': All(empty_none, Any(All(str, email), None)),
     'state': Any(str, None),
 }, required=True, extra=True)
+
+# Resources are validated one at a time (see `CkanBackend.validate_resource`)
+resource_schema = Schema(resource, required=True, extra=True)
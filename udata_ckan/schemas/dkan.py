@@ -5,10 +5,10 @@ from voluptuous import (
 )
 
 from udata.harvest.filters import (
-    boolean, email, slug, normalize_string,
-    is_url, empty_none, hash
+    boolean, email, normalize_string, is_url, empty_none, hash
 )
 
+from . import slug
 from .ckan import tag
 
 
@@ -93,3 +93,6 @@ schema = Schema({
     'maintainer_email': All(empty_none, Any(All(str, email), None)),
     'state': Any(str, None),
 }, required=True, extra=True)
+
+# Resources are validated one at a time (see `CkanBackend.validate_resource`)
+resource_schema = Schema(resource, required=True, extra=True)
@@ -0,0 +1,71 @@
+'''
+Solr queries built from the harvest source filters
+'''
+import re
+
+from datetime import timezone
+
+from dateutil.parser import parse as parse_date
+
+from udata.harvest.exceptions import HarvestException
+
+# Filter keys matching Solr fields with another name
+FIELDS = {
+    'modified_since': 'metadata_modified',
+}
+# Filter type making the values of same key filters alternatives
+ANY = 'any'
+# Characters requiring a value to be quoted (`+` and `-` only as prefix)
+SPECIAL_CHARS = re.compile(r'^[+-]|[\s&|!(){}\[\]^"~*?:\\/]')
+
+
+def quote(value):
+    '''Quote and escape a value for Solr, if needed'''
+    value = str(value)
+    if not value or SPECIAL_CHARS.search(value):
+        return '"{0}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+    return value
+
+
+def date_range(value):
+    '''A Solr range of the dates from `value`, interpreted as UTC without timezone'''
+    try:
+        since = parse_date(str(value))
+    except (ValueError, OverflowError):
+        raise HarvestException('Invalid date filter "{0}"'.format(value))
+    if since.tzinfo is not None:
+        since = since.astimezone(timezone.utc)
+    return '[{0:%Y-%m-%dT%H:%M:%S}Z TO *]'.format(since)
+
+
+def term(key, value):
+    return date_range(value) if key == 'modified_since' else quote(value)
+
+
+def build_query(filters):
+    '''
+    Build a Solr query from harvest `filters`, `None` if there is no filter.
+
+    Every included value is required and every excluded one is prohibited,
+    so included values on the same key must all match (`AND`).
+    Values of `any` filters on the same key are alternatives (`OR`): one of them must match.
+    Every clause is a required (`+`) or prohibited (`-`) one: CKAN <= 2.8 appends
+    its own required clauses to `fq`, which would make a single unprefixed clause optional.
+    '''
+    clauses = []
+    # Position in `clauses` and values of the `any` filters, by key
+    alternatives = {}
+    for f in filters:
+        key, value, kind = f['key'], f['value'], f.get('type')
+        if kind == ANY:
+            if key not in alternatives:
+                alternatives[key] = (len(clauses), [])
+                clauses.append(None)
+            alternatives[key][1].append(term(key, value))
+        else:
+            prefix = '-' if kind == 'exclude' else '+'
+            clauses.append('{0}{1}:{2}'.format(prefix, FIELDS.get(key, key), term(key, value)))
+    for key, (position, terms) in alternatives.items():
+        values = terms[0] if len(terms) == 1 else '({0})'.format(' OR '.join(terms))
+        clauses[position] = '+{0}:{1}'.format(FIELDS.get(key, key), values)
+    return ' '.join(clauses) or None
@@ -0,0 +1,27 @@
+from flask import current_app
+
+from udata.harvest import backends
+from udata.harvest.models import HarvestSource
+from udata.tasks import get_logger, job
+
+from .harvesters import CkanBackend, DEFAULT_DELTA_TIME_BUDGET
+
+log = get_logger(__name__)
+
+
+@job('harvest-ckan-delta', route='low.harvest')
+def harvest_delta(self, ident):
+    '''Harvest the packages changed since the last run of a CKAN source'''
+    log.info('Launching delta harvest job for source "%s"', ident)
+
+    source = HarvestSource.get(ident)
+    if source.deleted or not source.active:
+        log.info('Ignoring inactive or deleted source "%s"', ident)
+        return  # Ignore deleted and inactive sources
+    Backend = backends.get(current_app, source.backend)
+    if not issubclass(Backend, CkanBackend) or not any(
+            feature.key == 'activity_sync' for feature in Backend.features):
+        log.error('Delta harvest is not supported by the "%s" backend', source.backend)
+        return
+    budget = current_app.config.get('CKAN_DELTA_TIME_BUDGET', DEFAULT_DELTA_TIME_BUDGET)
+    Backend(source).harvest_delta(budget)
@@ -0,0 +1,210 @@
+'''
+HTTP transports performing the CKAN backends requests
+
+Transports are registered by name with `transport`, selected with the `CKAN_TRANSPORT`
+setting and instantiated with the `CKAN_TRANSPORT_OPTIONS` ones.
+Whatever the transport, responses are `requests` responses
+so the mapping and error handling code does not depend on it.
+'''
+import base64
+import json
+import logging
+
+from urllib.parse import urlencode
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import httpx
+except ImportError:  # Optional dependency: pip install udata-ckan[httpx]
+    httpx = None
+
+from udata.harvest.exceptions import HarvestException
+
+log = logging.getLogger(__name__)
+
+TRANSPORTS = {}
+
+DEFAULT_TRANSPORT = 'requests'
+
+
+def transport(name):
+    '''Register a transport class under a given name'''
+    def wrapper(cls):
+        TRANSPORTS[name] = cls
+        return cls
+    return wrapper
+
+
+def get_transport(name=DEFAULT_TRANSPORT, **options):
+    '''Instantiate the transport registered as `name` with the given options'''
+    try:
+        cls = TRANSPORTS[name]
+    except KeyError:
+        raise HarvestException('Unknown transport "{0}"'.format(name))
+    return cls(**options)
+
+
+def request_key(method, url, params=None):
+    '''A key identifying a request, independent of its headers and parameters order'''
+    query = urlencode(sorted((params or {}).items()), doseq=True)
+    return '{0} {1}{2}'.format(method, url, '?' + query if query else '')
+
+
+def build_response(url, status_code, headers, content, reason=None):
+    '''Build a `requests` response from its parts'''
+    response = requests.Response()
+    response.url = url
+    response.status_code = status_code
+    response.reason = reason
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response._content = content
+    return response
+
+
+class Transport(object):
+    '''
+    Perform HTTP requests.
+
+    `request` accepts the `params`, `data`, `headers` and `verify` keyword arguments.
+    '''
+    def request(self, method, url, **kwargs):
+        raise NotImplementedError
+
+    def close(self):
+        '''Release the transport resources once a run is over'''
+        pass
+
+
+@transport('requests')
+class RequestsTransport(Transport):
+    '''A new connection per request with `requests` (default)'''
+    def request(self, method, url, **kwargs):
+        return requests.request(method, url, **kwargs)
+
+
+@transport('session')
+class SessionTransport(Transport):
+    '''Keep-alive connections pooled by a `requests` session'''
+    def __init__(self, pool_size=10, retries=0):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size,
+                              max_retries=retries)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, url, **kwargs):
+        return self.session.request(method, url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+@transport('httpx')
+class HttpxTransport(Transport):
+    '''Keep-alive connections pooled by an `httpx` client, using HTTP/2 if `http2`'''
+    def __init__(self, http2=True, timeout=None):
+        if httpx is None:
+            raise HarvestException('The httpx transport requires the httpx package')
+        self.http2 = http2
+        self.timeout = timeout
+        # A client per SSL verification setting
+        self.clients = {}
+
+    def client(self, verify):
+        if verify not in self.clients:
+            self.clients[verify] = httpx.Client(http2=self.http2, verify=verify,
+                                                timeout=self.timeout)
+        return self.clients[verify]
+
+    def request(self, method, url, params=None, data=None, headers=None, verify=True):
+        response = self.client(verify).request(method, url, params=params, content=data,
+                                               headers=headers)
+        return build_response(str(response.url), response.status_code, response.headers,
+                              response.content, response.reason_phrase)
+
+    def close(self):
+        for client in self.clients.values():
+            client.close()
+        self.clients = {}
+
+
+@transport('record')
+class RecordTransport(Transport):
+    '''
+    Perform requests with another `transport`, recording the responses
+    as JSON lines appended to `path`, to be replayed by the `replay` transport.
+    '''
+    def __init__(self, path, transport=DEFAULT_TRANSPORT, **options):
+        self.path = path
+        self.transport = get_transport(transport, **options)
+        self.out = None
+
+    def request(self, method, url, params=None, **kwargs):
+        response = self.transport.request(method, url, params=params, **kwargs)
+        if self.out is None:
+            self.out = open(self.path, 'a')
+        self.out.write(json.dumps({
+            'key': request_key(method, url, params),
+            'status': response.status_code,
+            'reason': response.reason,
+            'headers': dict(response.headers),
+            'body': base64.b64encode(response.content).decode('ascii'),
+        }))
+        self.out.write('\n')
+        return response
+
+    def close(self):
+        if self.out is not None:
+            self.out.close()
+            self.out = None
+        self.transport.close()
+
+
+@transport('replay')
+class ReplayTransport(Transport):
+    '''Serve the responses recorded by the `record` transport in `path`, without network'''
+    def __init__(self, path):
+        self.responses = {}
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    exchange = json.loads(line)
+                    # The last response recorded for a request wins
+                    self.responses[exchange['key']] = exchange
+
+    def request(self, method, url, params=None, **kwargs):
+        key = request_key(method, url, params)
+        if key not in self.responses:
+            raise HarvestException('No recorded response for {0}'.format(key))
+        exchange = self.responses[key]
+        return build_response(url, exchange['status'], exchange['headers'],
+                              base64.b64decode(exchange['body']), exchange.get('reason'))
+
+
+@transport('fake')
+class FakeTransport(Transport):
+    '''
+    Serve in-memory JSON responses added with `add`, ie. for tests and benchmarks.
+
+    Unknown requests get a 404 response.
+    '''
+    def __init__(self):
+        self.responses = {}
+        self.requests = []
+
+    def add(self, url, payload, method='GET', params=None, status=200):
+        '''Serve `payload` as JSON for the given request'''
+        self.responses[request_key(method, url, params)] = (
+            status, json.dumps(payload).encode('utf-8')
+        )
+
+    def request(self, method, url, params=None, **kwargs):
+        key = request_key(method, url, params)
+        self.requests.append(key)
+        status, content = self.responses.get(key, (404, b'"Not found"'))
+        return build_response(url, status, {'Content-Type': 'application/json'}, content)